@@ -0,0 +1,119 @@
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+# Сессия, которая только что что-то записала, какое-то время читает
+# с основной базы, чтобы увидеть свои изменения до репликации.
+PIN_SESSION_KEY = '_pin_primary_until'
+
+# Записи этих приложений не означают изменений, которые пользователь
+# ждёт увидеть: сессия и метаданные миниатюр.
+UNPINNED_APPS = {'sessions', 'thumbnail'}
+
+_replica_allowed = contextvars.ContextVar('replica_allowed', default=False)
+_pinned = contextvars.ContextVar('pinned', default=False)
+_wrote = contextvars.ContextVar('wrote', default=None)
+
+
+def replicas():
+    """Реплики, которые не совпадают с основной базой.
+
+    В тестах реплики - зеркала default (TEST MIRROR): читать их через
+    отдельное соединение незачем.
+    """
+    primary = connections['default'].settings_dict['NAME']
+    return [
+        alias for alias in settings.DATABASE_REPLICAS
+        if connections[alias].settings_dict['NAME'] != primary
+    ]
+
+
+def read_replica(view):
+    """Разрешает вьюхе читать с реплик."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _replica_allowed.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _replica_allowed.reset(token)
+    return wrapper
+
+
+@contextmanager
+def use_primary():
+    """Читает с основной базы, даже во вьюхе с @read_replica."""
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+class ReplicaRouter:
+    """Чтение во вьюхах с @read_replica - с реплик, остальное - с основной.
+
+    Реплики перечислены в DATABASE_REPLICAS; пока их нет, все запросы
+    идут в default.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_allowed.get() and not _pinned.get():
+            aliases = replicas()
+            if aliases:
+                return random.choice(aliases)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        wrote = _wrote.get()
+        if wrote is not None and model._meta.app_label not in UNPINNED_APPS:
+            wrote.append(model._meta.label)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Реплики - копии основной базы и не мигрируются отдельно.
+        return db not in settings.DATABASE_REPLICAS
+
+
+def is_pinned(request):
+    """Сессия недавно что-то записала и должна видеть свои изменения."""
+    session = getattr(request, 'session', None)
+    return session is not None and (
+        session.get(PIN_SESSION_KEY, 0) > time.time()
+    )
+
+
+class PinPrimaryMiddleware:
+    """Read-your-writes: после записи сессия REPLICA_PIN_SECONDS секунд
+    читает с основной базы и не получает устаревших копий страниц
+    из кэша (posts.caching.cache_feed).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned_token = _pinned.set(is_pinned(request))
+        wrote_token = _wrote.set([])
+        try:
+            response = self.get_response(request)
+            wrote = _wrote.get()
+        finally:
+            _pinned.reset(pinned_token)
+            _wrote.reset(wrote_token)
+        if wrote:
+            request.session[PIN_SESSION_KEY] = (
+                time.time() + settings.REPLICA_PIN_SECONDS
+            )
+        return response
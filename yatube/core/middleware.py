@@ -0,0 +1,59 @@
+import json
+import logging
+import random
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger('yatube.requests')
+
+
+class RequestMetricsMiddleware:
+    """Число и время SQL-запросов, время шаблонов и попадания в кэш.
+
+    Для доли запросов REQUEST_METRICS_SAMPLE_RATE метрики попадают
+    в заголовок Server-Timing и строку лога yatube.requests в JSON;
+    остальные запросы проходят без накладных расходов.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.REQUEST_METRICS_SAMPLE_RATE:
+            return self.get_response(request)
+        current = metrics.RequestMetrics()
+        token = metrics.activate(current)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(current))
+                response = self.get_response(request)
+        finally:
+            metrics.deactivate(token)
+        response['Server-Timing'] = server_timing(current)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': current.queries,
+            'db_ms': round(current.db_time * 1000, 1),
+            'template_ms': round(current.template_time * 1000, 1),
+            'cache_hits': current.cache_hits,
+            'cache_misses': current.cache_misses,
+            'total_ms': round(current.total_time * 1000, 1),
+        }))
+        return response
+
+
+def server_timing(current):
+    return ', '.join([
+        f'db;dur={current.db_time * 1000:.1f};'
+        f'desc="{current.queries} queries"',
+        f'tpl;dur={current.template_time * 1000:.1f}',
+        f'cache;desc="{current.cache_hits} hit, {current.cache_misses} miss"',
+        f'total;dur={current.total_time * 1000:.1f}',
+    ])
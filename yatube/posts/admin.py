@@ -1,6 +1,7 @@
 from django.contrib import admin
 
 from .models import Comment, Group, Post
+from .search import has_index, match_expression, matching_ids
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -16,6 +17,12 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Полнотекстовый индекс вместо LIKE '%...%' по всем постам.
+        if has_index() and match_expression(search_term):
+            return queryset.filter(pk__in=matching_ids(search_term)), False
+        return super().get_search_results(request, queryset, search_term)
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = (
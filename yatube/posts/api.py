@@ -0,0 +1,172 @@
+from functools import wraps
+
+from django.conf import settings
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+
+from core.db_router import read_replica
+
+from .caching import cache_feed, conditional_feed
+from .models import Comment, Group, Post, User
+from .timeline import timeline_posts
+from .utils import CursorPaginator, InvalidCursor
+from .views import feed_posts, post_author_scope
+
+# Поле ответа -> выражение для .values().
+POST_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+    'comments_count': 'comments_count',
+}
+COMMENT_FIELDS = {
+    'id': 'id',
+    'author': 'author__username',
+    'text': 'text',
+    'created': 'created',
+}
+MAX_LIMIT = 100
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def error(message, status=400):
+    return JsonResponse(
+        {'error': message}, status=status,
+        json_dumps_params={'ensure_ascii': False},
+    )
+
+
+def api_view(view):
+    """Ошибки API - JSON с описанием вместо HTML-страницы."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as exception:
+            return error(str(exception))
+        except Http404:
+            return error('Не найдено', status=404)
+    return wrapper
+
+
+def selected_fields(request, available, param='fields'):
+    """Поля из ?fields=id,text; без параметра - все."""
+    value = request.GET.get(param)
+    if not value:
+        return list(available)
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise BadRequest(f'Неизвестные поля: {", ".join(unknown)}')
+    return names
+
+
+def page_limit(request, param, default):
+    value = request.GET.get(param)
+    if value is None:
+        return default
+    if not value.isdigit() or not 1 <= int(value) <= MAX_LIMIT:
+        raise BadRequest(f'{param} должен быть от 1 до {MAX_LIMIT}')
+    return int(value)
+
+
+def serialize_rows(rows, names, available):
+    items = [{name: row[available[name]] for name in names} for row in rows]
+    if 'image' in names and available is POST_FIELDS:
+        storage = Post._meta.get_field('image').storage
+        for item in items:
+            if item['image']:
+                item['image'] = storage.url(item['image'])
+    return items
+
+
+def cursor_page(queryset, names, available, cursor, per_page):
+    """Страница словарей из .values(): модели не создаются.
+
+    В выборку добавляются поля сортировки, по ним строятся курсоры.
+    """
+    ordering = queryset.query.order_by or queryset.model._meta.ordering
+    sort_fields = [name.lstrip('-') for name in ordering]
+    lookups = {available[name] for name in names} | set(sort_fields)
+    paginator = CursorPaginator(
+        queryset.values(*lookups), per_page, ordering=ordering
+    )
+    try:
+        page = paginator.page(cursor)
+    except InvalidCursor:
+        raise BadRequest('Неверный курсор')
+    return {
+        'results': serialize_rows(page, names, available),
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+    }
+
+
+def posts_response(request, posts):
+    names = selected_fields(request, POST_FIELDS)
+    limit = page_limit(request, 'limit', settings.POSTS_ON_PAGE)
+    return JsonResponse(
+        cursor_page(posts, names, POST_FIELDS,
+                    request.GET.get('cursor'), limit),
+        json_dumps_params={'ensure_ascii': False},
+    )
+
+
+@read_replica
+@cache_feed('index')
+@api_view
+def index(request):
+    return posts_response(request, feed_posts())
+
+
+@read_replica
+@cache_feed('group:{slug}')
+@api_view
+def group_posts(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return posts_response(request, feed_posts(group.posts))
+
+
+@read_replica
+@cache_feed('author:{username}')
+@api_view
+def profile(request, username):
+    author = get_object_or_404(User, username=username)
+    return posts_response(request, feed_posts(author.posts))
+
+
+@read_replica
+@conditional_feed('post:{post_id}', post_author_scope)
+@api_view
+def post_detail(request, post_id):
+    names = selected_fields(request, POST_FIELDS)
+    comment_names = selected_fields(
+        request, COMMENT_FIELDS, 'comment_fields'
+    )
+    limit = page_limit(request, 'comments_limit', settings.COMMENTS_ON_PAGE)
+    rows = Post.objects.filter(pk=post_id).values(
+        *{POST_FIELDS[name] for name in names}
+    )
+    posts = serialize_rows(rows, names, POST_FIELDS)
+    if not posts:
+        raise Http404
+    post = posts[0]
+    post['comments'] = cursor_page(
+        Comment.objects.filter(post_id=post_id), comment_names,
+        COMMENT_FIELDS, request.GET.get('comments'), limit,
+    )
+    return JsonResponse(post, json_dumps_params={'ensure_ascii': False})
+
+
+@read_replica
+@api_view
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return error('Нужна авторизация', status=401)
+    return posts_response(request, timeline_posts(request.user))
@@ -0,0 +1,147 @@
+from contextlib import contextmanager
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from . import counters, timeline
+from .caching import bump_versions
+from .models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+DATE_FIELDS = [(Post, 'pub_date'), (Comment, 'created')]
+# Больше строк в одном INSERT SQLite не принимает.
+BATCH_SIZE = 500
+
+
+@contextmanager
+def explicit_dates(*models):
+    """Даёт bulk_create записать даты моделей как есть.
+
+    Флаг auto_now_add общий для всего процесса, поэтому держать его
+    снятым стоит только на время самой вставки. Без моделей - для
+    постов и комментариев.
+    """
+    fields = [
+        model._meta.get_field(name) for model, name in DATE_FIELDS
+        if not models or model in models
+    ]
+    saved = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, saved):
+            field.auto_now_add = value
+
+
+@contextmanager
+def deferred_indexes(*models):
+    """Снимает вторичные индексы моделей на время массовой вставки.
+
+    Один индекс, построенный по готовой таблице, дешевле, чем
+    обновление каждого индекса на каждой вставленной строке.
+    Ограничения уникальности остаются на месте.
+    """
+    indexes = [(model, index) for model in models
+               for index in model._meta.indexes]
+    with connection.schema_editor() as editor:
+        for model, index in indexes:
+            editor.remove_index(model, index)
+    try:
+        yield
+    finally:
+        with connection.schema_editor() as editor:
+            for model, index in indexes:
+                editor.add_index(model, index)
+
+
+def chunked(ids, size=BATCH_SIZE):
+    ids = iter(ids)
+    while True:
+        chunk = list(islice(ids, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Touched:
+    """Что затронула массовая загрузка: чьи счётчики, ленты и кэш
+    обновить после неё.
+    """
+
+    def __init__(self):
+        self.users = set()
+        self.usernames = set()
+        self.posts = set()
+        self.groups = set()
+        self.slugs = set()
+        # Авторы новых постов и читатели новых подписок.
+        self.authors = set()
+        self.readers = set()
+        self.index = False
+
+    def add(self, objects):
+        for obj in objects:
+            if isinstance(obj, User):
+                self.usernames.add(obj.username)
+            elif isinstance(obj, Group):
+                self.slugs.add(obj.slug)
+            elif isinstance(obj, Post):
+                self.authors.add(obj.author_id)
+                self.groups.add(obj.group_id)
+                self.posts.add(obj.pk)
+                self.index = True
+            elif isinstance(obj, Comment):
+                self.posts.add(obj.post_id)
+            elif isinstance(obj, Follow):
+                self.users.update((obj.user_id, obj.author_id))
+                self.readers.add(obj.user_id)
+        # Без явного id загруженные строки известны только по полям.
+        self.posts.discard(None)
+        self.groups.discard(None)
+
+
+def refresh_derived(touched=None):
+    """Пересчитывает то, что при bulk_create не обновили сигналы.
+
+    touched ограничивает пересчёт затронутыми загрузкой строками;
+    без него пересчитываются все счётчики и ленты и сбрасывается
+    кэш всех лент.
+    """
+    if touched is None:
+        counters.recount_all()
+        timeline.rebuild()
+        bump_versions('feeds')
+        return
+    users = touched.users | touched.authors
+    for chunk in chunked(touched.usernames):
+        users.update(User.objects.filter(username__in=chunk).values_list(
+            'pk', flat=True
+        ))
+    for chunk in chunked(users):
+        counters.recount_users(chunk)
+    for chunk in chunked(touched.posts):
+        counters.recount_posts(chunk)
+    for chunk in chunked(touched.authors):
+        timeline.rebuild(author_ids=chunk)
+    for chunk in chunked(touched.readers):
+        timeline.rebuild(user_ids=chunk)
+    scopes = ['index'] if touched.index else []
+    scopes += [f'post:{pk}' for pk in touched.posts]
+    slugs = set(touched.slugs)
+    for chunk in chunked(touched.groups):
+        slugs.update(Group.objects.filter(pk__in=chunk).values_list(
+            'slug', flat=True
+        ))
+    scopes += [f'group:{slug}' for slug in slugs]
+    for chunk in chunked(users):
+        scopes += [
+            f'author:{username}' for username in User.objects.filter(
+                pk__in=chunk
+            ).values_list('username', flat=True)
+        ]
+    if scopes:
+        bump_versions(*scopes)
@@ -0,0 +1,258 @@
+import hashlib
+import math
+import random
+import time
+import uuid
+from collections import namedtuple
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from core.db_router import is_pinned, use_primary
+from core.metrics import record_cache
+
+VERSION_KEY = 'feed_version:{}'
+PAGE_KEY = 'feed_page:{}'
+LOCK_KEY = 'lock:{}'
+
+# Значение в кэше со сроком годности и временем, за которое его собрали.
+Envelope = namedtuple('Envelope', 'value expires delta')
+
+
+def _now():
+    # Версия - время изменения в миллисекундах: после вытеснения ключа
+    # из кэша новая версия всё равно окажется больше старой.
+    return int(time.time() * 1000)
+
+
+def version_key(scope):
+    # В областях есть слаги и имена пользователей: кириллица, а иногда
+    # и длина недопустимы для ключей memcached.
+    return VERSION_KEY.format(hashlib.md5(scope.encode()).hexdigest())
+
+
+def get_versions(scopes):
+    keys = [version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _now(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump_versions(*scopes):
+    """Инвалидирует все страницы, собранные из данных этих областей."""
+    keys = [version_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    now = _now()
+    cache.set_many(
+        {key: max(now, found.get(key, 0) + 1) for key in keys}, None
+    )
+
+
+def bump_on_commit(*scopes):
+    """bump_versions для изменений внутри транзакции.
+
+    Пока транзакция не закрыта, параллельный запрос может собрать
+    страницу из старых данных под уже новой версией. Повторная
+    инвалидация после коммита сбрасывает и такие страницы; первая
+    нужна, чтобы та же транзакция не читала свой старый кэш.
+    """
+    bump_versions(*scopes)
+    transaction.on_commit(lambda: bump_versions(*scopes))
+
+
+def _expired_early(envelope):
+    """Вероятностное досрочное обновление (XFetch).
+
+    Чем ближе срок и чем дольше значение собирается, тем вероятнее,
+    что очередной запрос обновит его заранее, и одновременного
+    промаха у всех запросов не будет.
+    """
+    gap = -envelope.delta * settings.CACHE_EARLY_REFRESH_BETA * math.log(
+        1 - random.random()
+    )
+    return time.time() + gap >= envelope.expires
+
+
+def _build(key, build, timeout, cacheable, stale_key):
+    started = time.time()
+    value = build()
+    if cacheable(value):
+        envelope = Envelope(
+            value, started + timeout, time.time() - started
+        )
+        values = {key: envelope}
+        if stale_key:
+            values[stale_key] = envelope
+        cache.set_many(values, timeout)
+    return value
+
+
+def get_or_build(key, build, timeout, cacheable=lambda value: True,
+                 stale_key=None, allow_stale=True):
+    """Значение из кэша; собирает его только один процесс за раз.
+
+    Пока один запрос собирает значение под блокировкой (cache.add),
+    остальные отдают устаревшую копию из stale_key или ждут
+    CACHE_LOCK_WAIT секунд и собирают сами. allow_stale=False - только
+    ждать: stale_key тогда лишь обновляется. Возвращает пару
+    (значение, устарело ли оно).
+    """
+    envelope = cache.get(key)
+    if not isinstance(envelope, Envelope):
+        envelope = None
+    if envelope is not None and not _expired_early(envelope):
+        record_cache(hits=1)
+        return envelope.value, False
+    lock_key = LOCK_KEY.format(key)
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, settings.CACHE_LOCK_TIMEOUT):
+        record_cache(misses=1)
+        try:
+            return _build(key, build, timeout, cacheable, stale_key), False
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+    if envelope is not None:
+        # Досрочное обновление уже идёт в другом запросе.
+        record_cache(hits=1)
+        return envelope.value, False
+    stale = cache.get(stale_key) if stale_key and allow_stale else None
+    if isinstance(stale, Envelope):
+        record_cache(hits=1)
+        return stale.value, True
+    deadline = time.monotonic() + settings.CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        envelope = cache.get(key)
+        if isinstance(envelope, Envelope):
+            record_cache(hits=1)
+            return envelope.value, False
+    record_cache(misses=1)
+    return _build(key, build, timeout, cacheable, stale_key), False
+
+
+def page_hash(request, versions):
+    user_id = request.user.pk if request.user.is_authenticated else 0
+    raw = '|'.join(
+        [request.get_full_path(), str(user_id)] + [str(v) for v in versions]
+    )
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def page_key(request, versions):
+    return PAGE_KEY.format(page_hash(request, versions))
+
+
+def feed_scopes(scopes, kwargs):
+    """Области страницы; область-функция получает аргументы вьюхи."""
+    return ['feeds'] + [
+        scope(**kwargs) if callable(scope) else scope.format(**kwargs)
+        for scope in scopes
+    ]
+
+
+def conditional_response(request, versions, get_response):
+    """Ответ 304, если у клиента страница тех же версий.
+
+    ETag - хэш адреса, пользователя и версий областей, Last-Modified -
+    секунда последнего изменения, если она уже прошла; для проверки
+    не нужно ни запросов к базе, ни шаблонов.
+    """
+    etag = f'"{page_hash(request, versions)}"'
+    last_modified = max(versions) // 1000
+    if last_modified >= int(time.time()):
+        # Last-Modified точен до секунды: изменение в ту же секунду его
+        # не сдвинет, и клиент с одним If-Modified-Since получил бы 304
+        # на новые данные. Пока секунда не кончилась - только ETag.
+        last_modified = None
+    response = get_conditional_response(request, etag, last_modified)
+    if response is None:
+        response = get_response()
+    if getattr(response, 'stale', False):
+        # Устаревшей копии нельзя давать валидаторы новых версий.
+        patch_cache_control(response, private=True, no_cache=True)
+    elif response.status_code in (200, 304):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # Страница зависит от пользователя и должна перепроверяться.
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional_feed(*scopes):
+    """Отвечает 304 Not Modified, пока не изменились данные областей."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            versions = get_versions(feed_scopes(scopes, kwargs))
+            return conditional_response(
+                request, versions, lambda: view(request, *args, **kwargs)
+            )
+        return wrapper
+    return decorator
+
+
+def cache_feed(*scopes, when=None):
+    """Кэширует страницу ленты до изменения данных, из которых она собрана.
+
+    Области могут ссылаться на аргументы вьюхи: 'group:{slug}'.
+    Общая область 'feeds' входит в каждую ленту. Заодно отвечает
+    на условные запросы, как conditional_feed. Страницу после
+    изменения собирает один запрос, остальные получают предыдущую
+    версию (get_or_build). when(request) - кэшировать ли этот запрос.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or (
+                when is not None and not when(request)
+            ):
+                return view(request, *args, **kwargs)
+            versions = get_versions(feed_scopes(scopes, kwargs))
+            # Реплика могла ещё не получить недавнее изменение, а
+            # собранная с неё страница лежала бы в кэше под новой
+            # версией: такие страницы собираются с основной базы.
+            changed = max(versions) / 1000
+            recent = time.time() - changed < settings.REPLICA_PIN_SECONDS
+
+            def build():
+                if recent:
+                    with use_primary():
+                        return view(request, *args, **kwargs)
+                return view(request, *args, **kwargs)
+
+            def get_response():
+                response, stale = get_or_build(
+                    page_key(request, versions),
+                    build,
+                    settings.FEED_CACHE_TIMEOUT,
+                    cacheable=lambda response: response.status_code == 200,
+                    # Последняя собранная версия страницы.
+                    stale_key=page_key(request, []),
+                    # Сессия, которая только что писала, ждёт новую.
+                    allow_stale=not is_pinned(request),
+                )
+                response.stale = stale
+                return response
+
+            return conditional_response(request, versions, get_response)
+        return wrapper
+    return decorator
+
+
+def post_scopes(post):
+    """Области кэша, в которых выводится пост."""
+    scopes = ['index', f'post:{post.pk}', f'author:{post.author.username}']
+    if post.group_id:
+        scopes.append(f'group:{post.group.slug}')
+    return scopes
@@ -0,0 +1,82 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Follow, Post, UserCounters
+
+User = get_user_model()
+
+
+def change_user(user_id, **deltas):
+    """Атомарно сдвигает счётчики пользователя.
+
+    change_user(1, posts_count=1)
+    """
+    values = {name: F(name) + delta for name, delta in deltas.items()}
+    if UserCounters.objects.filter(user_id=user_id).update(**values):
+        return
+    # Строки нет, если пользователя удаляют каскадом: уменьшать нечего,
+    # а созданная заново строка ушла бы в минус.
+    if min(deltas.values()) > 0:
+        UserCounters.objects.get_or_create(user_id=user_id)
+        UserCounters.objects.filter(user_id=user_id).update(**values)
+
+
+def change_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=F('comments_count') + delta
+    )
+
+
+def _count(queryset, field):
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(total=Count('pk')).values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def recount_users(user_ids=None):
+    """Пересчитывает счётчики пользователей из user_ids; None - всех."""
+    users = User.objects.all()
+    rows = UserCounters.objects.all()
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+        rows = rows.filter(user_id__in=user_ids)
+    with transaction.atomic():
+        UserCounters.objects.bulk_create(
+            [
+                UserCounters(user_id=user_id)
+                for user_id in users.filter(
+                    counters__isnull=True
+                ).values_list('pk', flat=True).iterator()
+            ],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+        # Первичный ключ счётчиков совпадает с id пользователя.
+        rows.update(
+            posts_count=_count(Post.objects, 'author'),
+            followers_count=_count(Follow.objects, 'author'),
+            following_count=_count(Follow.objects, 'user'),
+        )
+
+
+def recount_posts(post_ids=None):
+    """Пересчитывает число комментариев постов из post_ids; None - всех."""
+    posts = Post.objects.all()
+    if post_ids is not None:
+        posts = posts.filter(pk__in=post_ids)
+    posts.update(comments_count=_count(Comment.objects, 'post'))
+
+
+def recount_all():
+    """Пересчитывает все счётчики по данным таблиц."""
+    with transaction.atomic():
+        recount_users()
+        recount_posts()
@@ -0,0 +1,100 @@
+import csv
+import io
+import json
+import zlib
+
+from .models import Comment, Follow, Group, Post
+
+# Выгружаемые таблицы и их поля; связи - по первичным ключам.
+TABLES = {
+    'groups': (Group, ['id', 'title', 'slug', 'description']),
+    'posts': (
+        Post,
+        ['id', 'author_id', 'group_id', 'pub_date', 'text', 'image'],
+    ),
+    'comments': (
+        Comment, ['id', 'post_id', 'author_id', 'created', 'text']
+    ),
+    'follows': (Follow, ['id', 'user_id', 'author_id']),
+}
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+BATCH_SIZE = 2000
+
+
+def batches(table, batch_size=BATCH_SIZE):
+    """Строки таблицы пачками по первичному ключу.
+
+    Каждая пачка - отдельный запрос по индексу pk, так что память не
+    зависит от размера таблицы и длинная выгрузка не держит открытым
+    один курсор.
+    """
+    model, fields = TABLES[table]
+    rows = model.objects.order_by('pk').values_list(*fields)
+    last = None
+    while True:
+        batch = rows if last is None else rows.filter(pk__gt=last)
+        batch = list(batch[:batch_size])
+        if not batch:
+            return
+        yield batch
+        last = batch[-1][0]
+
+
+def _plain(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def ndjson_chunks(table, batch_size=BATCH_SIZE):
+    _, fields = TABLES[table]
+    for batch in batches(table, batch_size):
+        yield ''.join(
+            json.dumps(
+                dict(zip(fields, map(_plain, row))), ensure_ascii=False
+            ) + '\n'
+            for row in batch
+        )
+
+
+def csv_chunks(table, batch_size=BATCH_SIZE):
+    _, fields = TABLES[table]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for batch in batches(table, batch_size):
+        writer.writerows(
+            ['' if value is None else _plain(value) for value in row]
+            for row in batch
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Заголовок пустой таблицы.
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    """Сжимает поток на лету в формат gzip."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(table, format='ndjson', compress=False, batch_size=None):
+    """Поток байтов выгрузки таблицы."""
+    batch_size = batch_size or BATCH_SIZE
+    chunks = {'ndjson': ndjson_chunks, 'csv': csv_chunks}[format](
+        table, batch_size
+    )
+    chunks = (chunk.encode() for chunk in chunks)
+    if compress:
+        chunks = gzip_chunks(chunks)
+    return chunks
@@ -0,0 +1,108 @@
+from django.conf import settings
+from django.contrib.syndication.views import Feed
+from django.shortcuts import get_object_or_404
+from django.template.defaultfilters import linebreaksbr, truncatechars
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed
+
+from core.db_router import read_replica
+
+from .caching import cache_feed
+from .models import Group, User
+from .views import feed_posts
+
+
+class LatestPostsFeed(Feed):
+    title = 'Yatube: последние записи'
+    description = 'Новые записи на сайте.'
+
+    def link(self):
+        return reverse('posts:index')
+
+    def items(self):
+        # Те же запросы и индексы, что у лент на страницах.
+        return feed_posts()[:settings.SYNDICATION_ITEMS]
+
+    def item_title(self, item):
+        return truncatechars(item.text, 80)
+
+    def item_description(self, item):
+        return linebreaksbr(item.text, autoescape=True)
+
+    def item_link(self, item):
+        return reverse('posts:post_detail', args=(item.pk,))
+
+    def item_pubdate(self, item):
+        return item.pub_date
+
+    def item_author_name(self, item):
+        return item.author.get_full_name() or item.author.username
+
+    def item_categories(self, item):
+        return [item.group.title] if item.group else []
+
+
+class GroupPostsFeed(LatestPostsFeed):
+    def get_object(self, request, slug):
+        return get_object_or_404(Group, slug=slug)
+
+    def title(self, group):
+        return f'Yatube: {group.title}'
+
+    def description(self, group):
+        return group.description
+
+    def link(self, group):
+        return reverse('posts:group_list', args=(group.slug,))
+
+    def items(self, group):
+        return feed_posts(group.posts)[:settings.SYNDICATION_ITEMS]
+
+
+class AuthorPostsFeed(LatestPostsFeed):
+    def get_object(self, request, username):
+        return get_object_or_404(User, username=username)
+
+    def title(self, author):
+        return f'Yatube: {author.get_full_name() or author.username}'
+
+    def description(self, author):
+        return f'Записи пользователя {author.username}.'
+
+    def link(self, author):
+        return reverse('posts:profile', args=(author.username,))
+
+    def items(self, author):
+        return feed_posts(author.posts)[:settings.SYNDICATION_ITEMS]
+
+
+class LatestPostsAtomFeed(LatestPostsFeed):
+    feed_type = Atom1Feed
+    subtitle = LatestPostsFeed.description
+
+
+class GroupPostsAtomFeed(GroupPostsFeed):
+    feed_type = Atom1Feed
+
+    def subtitle(self, group):
+        return group.description
+
+
+class AuthorPostsAtomFeed(AuthorPostsFeed):
+    feed_type = Atom1Feed
+
+    def subtitle(self, author):
+        return self.description(author)
+
+
+def feed_view(feed, *scopes):
+    """Лента с кэшем и условными запросами, как у страниц лент."""
+    return read_replica(cache_feed(*scopes)(feed()))
+
+
+index_rss = feed_view(LatestPostsFeed, 'index')
+index_atom = feed_view(LatestPostsAtomFeed, 'index')
+group_rss = feed_view(GroupPostsFeed, 'group:{slug}')
+group_atom = feed_view(GroupPostsAtomFeed, 'group:{slug}')
+profile_rss = feed_view(AuthorPostsFeed, 'author:{username}')
+profile_atom = feed_view(AuthorPostsAtomFeed, 'author:{username}')
@@ -0,0 +1,143 @@
+import os
+import time
+import uuid
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image, ImageOps
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from .models import Post
+from .thumbnails import thumbnail_file, variants
+
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+CONTENT_TYPES = {
+    'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp'
+}
+
+
+def normalize_image(upload):
+    """Приводит загруженную картинку к размеру и формату из настроек.
+
+    Картинка поворачивается по EXIF-ориентации, уменьшается до
+    POST_IMAGE_MAX_SIZE и пересохраняется без метаданных. JPEG
+    декодируется сразу в уменьшенном масштабе (draft), поэтому даже
+    большие фотографии с камеры не разворачиваются в памяти целиком.
+    """
+    upload.seek(0)
+    max_size = settings.POST_IMAGE_MAX_SIZE
+    image_format = settings.POST_IMAGE_FORMAT
+    output = BytesIO()
+    try:
+        image = Image.open(upload)
+        image.draft('RGB', max_size)
+        # Размер после draft - столько пикселей и будет декодировано.
+        width, height = image.size
+        if width * height > settings.POST_IMAGE_MAX_PIXELS:
+            raise ValidationError(
+                'Картинка слишком большая: %(width)sx%(height)s.',
+                code='image_too_large',
+                params={'width': width, 'height': height},
+            )
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(max_size, Image.LANCZOS)
+        if image_format == 'JPEG':
+            image = _flatten(image)
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        image.save(
+            output,
+            format=image_format,
+            quality=settings.POST_IMAGE_QUALITY,
+            optimize=True,
+        )
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        # Битый или обрезанный файл, который прошёл проверку ImageField.
+        raise ValidationError(
+            'Не удалось обработать картинку.', code='invalid_image'
+        )
+    name = os.path.splitext(os.path.basename(upload.name))[0]
+    return SimpleUploadedFile(
+        f'{name}.{EXTENSIONS[image_format]}',
+        output.getvalue(),
+        content_type=CONTENT_TYPES[image_format],
+    )
+
+
+def _flatten(image):
+    """Убирает прозрачность, которой нет в JPEG, заливая фон белым."""
+    if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def release_image(name):
+    """Удаляет файл картинки и её миниатюры, если на неё нет ссылок.
+
+    Ссылками считаются посты с этим именем файла: хранилище раздаёт
+    одинаковым картинкам одно имя. Файл, который загружали заново
+    меньше POST_IMAGE_RELEASE_GRACE секунд назад, остаётся до
+    sweep_images. Возвращает, удалён ли файл.
+    """
+    if not name or Post.objects.filter(image=name).exists():
+        return False
+    storage = Post._meta.get_field('image').storage
+    try:
+        path = storage.path(name)
+    except SuspiciousFileOperation:
+        # Путь вне MEDIA_ROOT записан в базу в обход формы: файл не наш.
+        return False
+    # Файл сначала уходит из-под своего имени: загрузка той же картинки
+    # после этого запишет его заново. Загрузки, которые успели раньше,
+    # обновили время изменения, а сохранённые посты видны в базе.
+    removed = f'{path}.{uuid.uuid4().hex}.deleted'
+    try:
+        os.replace(path, removed)
+    except FileNotFoundError:
+        return False
+    reused = os.path.getmtime(removed) > (
+        time.time() - settings.POST_IMAGE_RELEASE_GRACE
+    )
+    if reused or Post.objects.filter(image=name).exists():
+        os.replace(removed, path)
+        return False
+    os.remove(removed)
+    source = ImageFile(name, storage)
+    for _, geometry, options in variants():
+        thumbnail_file(source, geometry, options)[0].delete()
+    default.kvstore.delete(source)
+    return True
+
+
+def sweep_images():
+    """Удаляет картинки постов, на которые не осталось ссылок.
+
+    Подбирает файлы, которые release_image оставил как недавно
+    загруженные. Возвращает число удалённых файлов.
+    """
+    storage = Post._meta.get_field('image').storage
+    upload_to = Post._meta.get_field('image').upload_to
+    root = storage.path(upload_to)
+    names = [
+        os.path.relpath(os.path.join(directory, file), storage.location)
+        .replace(os.sep, '/')
+        for directory, _, files in os.walk(root)
+        for file in files
+        if not file.endswith(('.part', '.deleted'))
+    ]
+    removed = 0
+    for start in range(0, len(names), 500):
+        chunk = names[start:start + 500]
+        used = set(Post.objects.filter(image__in=chunk).values_list(
+            'image', flat=True
+        ))
+        removed += sum(
+            release_image(name) for name in chunk if name not in used
+        )
+    return removed
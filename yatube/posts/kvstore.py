@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+from core.metrics import record_cache
+from sorl.thumbnail.conf import settings
+from sorl.thumbnail.images import deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore as CachedDBStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+
+class LocalCache:
+    """LRU-словарь процесса с ограниченным временем жизни записей."""
+
+    def __init__(self):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + settings.THUMBNAIL_LOCAL_TIMEOUT
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > settings.THUMBNAIL_LOCAL_SIZE:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class KVStore(CachedDBStore):
+    """Хранилище sorl: память процесса, затем общий кэш, затем база.
+
+    Другие процессы не могут сбросить память этого процесса, поэтому
+    записи в ней живут недолго (THUMBNAIL_LOCAL_TIMEOUT).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.local = LocalCache()
+
+    def get_many(self, image_files):
+        """Метаданные миниатюр за один проход по каждому уровню.
+
+        Возвращает словарь {ключ картинки: ImageFile} для найденных;
+        найденное записывается в верхние уровни.
+        """
+        keys = {add_prefix(image_file.key): image_file.key
+                for image_file in image_files}
+        found = {}
+        missing = []
+        for raw_key in keys:
+            value = self.local.get(raw_key)
+            if value is None:
+                missing.append(raw_key)
+            else:
+                found[raw_key] = value
+        if missing:
+            cached = self.cache.get_many(missing)
+            rest = [key for key in missing if key not in cached]
+            record_cache(hits=len(cached), misses=len(rest))
+            if rest:
+                from_db = dict.fromkeys(rest, EMPTY_VALUE)
+                from_db.update(
+                    KVStoreModel.objects.filter(key__in=rest)
+                    .values_list('key', 'value')
+                )
+                # Как и sorl, кэшируем и промахи, чтобы не ходить в базу.
+                self.cache.set_many(
+                    from_db, settings.THUMBNAIL_CACHE_TIMEOUT
+                )
+                cached.update(from_db)
+            for raw_key, value in cached.items():
+                if value != EMPTY_VALUE:
+                    self.local.set(raw_key, value)
+                    found[raw_key] = value
+        return {
+            keys[raw_key]: deserialize_image_file(value)
+            for raw_key, value in found.items()
+        }
+
+    def clear_local(self):
+        self.local.clear()
+
+    def _get_raw(self, key):
+        value = self.local.get(key)
+        if value is None:
+            value = super()._get_raw(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def _set_raw(self, key, value):
+        super()._set_raw(key, value)
+        self.local.set(key, value)
+
+    def _delete_raw(self, *keys):
+        super()._delete_raw(*keys)
+        self.local.delete(*keys)
+
+    def clear(self, delete_thumbnails=False):
+        super().clear(delete_thumbnails)
+        self.local.clear()
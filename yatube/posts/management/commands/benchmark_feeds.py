@@ -0,0 +1,226 @@
+import json
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import (override_settings, setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from posts import synthetic
+from posts.models import Group, Post, User
+from posts.utils import CursorPage
+
+
+# Замеры идут на временной базе: общий кэш сайта они бы чистили
+# и наполняли страницами, собранными из синтетических данных.
+LOCAL_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentiles(values):
+    if len(values) < 2:
+        # quantiles нужны хотя бы два значения.
+        values = values * 2
+    points = statistics.quantiles(values, n=100, method='inclusive')
+    return {
+        'p50': round(points[49], 2),
+        'p95': round(points[94], 2),
+        'p99': round(points[98], 2),
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет ленты на синтетических данных во временной тестовой '
+        'базе и печатает результат в JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--groups', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Среднее число подписок на пользователя.'
+        )
+        parser.add_argument(
+            '--alpha', type=float, default=1.2,
+            help='Показатель степенного закона популярности авторов.'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Запросов к каждой вьюхе в каждом режиме кэша.'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output', help='Файл для JSON; по умолчанию stdout.'
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        local_cache = override_settings(CACHES=LOCAL_CACHES)
+        local_cache.enable()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            started = time.perf_counter()
+            synthetic.generate(
+                users=options['users'],
+                groups=options['groups'],
+                posts=options['posts'],
+                comments=options['comments'],
+                follows=options['follows'],
+                alpha=options['alpha'],
+                seed=options['seed'],
+            )
+            generated = time.perf_counter() - started
+            report = {
+                'params': {
+                    key: options[key] for key in (
+                        'users', 'groups', 'posts', 'comments', 'follows',
+                        'alpha', 'requests', 'seed',
+                    )
+                },
+                'environment': {
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'database': connection.vendor,
+                },
+                'generate_seconds': round(generated, 2),
+                'views': self.measure(options['requests'], options['seed']),
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            local_cache.disable()
+            teardown_test_environment()
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(data)
+            self.stderr.write(f'Результат записан в {options["output"]}')
+        else:
+            self.stdout.write(data)
+
+    def targets(self):
+        """Адреса вьюх на самых нагруженных объектах.
+
+        Для каждой - имя страницы в контексте и параметр курсора,
+        по которым пользователь листает дальше.
+        """
+        group = Group.objects.annotate(
+            size=Count('posts')
+        ).order_by('-size').first()
+        author = User.objects.order_by('-counters__followers_count').first()
+        reader = User.objects.order_by('-counters__following_count').first()
+        post = Post.objects.order_by('-comments_count').first()
+        feed = ('page_obj', 'cursor')
+        return reader, {
+            'index': (reverse('posts:index'), *feed),
+            'group_posts': (
+                reverse('posts:group_list', kwargs={'slug': group.slug}),
+                *feed,
+            ),
+            'profile': (
+                reverse('posts:profile', kwargs={'username': author.username}),
+                *feed,
+            ),
+            'post_detail': (
+                reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+                'comments', 'comments',
+            ),
+            'follow_index': (reverse('posts:follow_index'), *feed),
+        }
+
+    def pages(self, client, url, context_name, param, depth=5):
+        """Первые depth страниц по ссылкам "дальше", как листает
+        пользователь: ленты - по курсорам, а не по ?page.
+        """
+        pages = [url]
+        while len(pages) < depth:
+            cache.clear()
+            response = client.get(pages[-1])
+            page = response.context[context_name]
+            if not page.has_next():
+                break
+            if isinstance(page, CursorPage):
+                query = {param: page.next_cursor}
+            else:
+                # Лента подписок листается по номерам.
+                query = {'page': page.next_page_number()}
+            pages.append(f'{url}?{urlencode(query)}')
+        return pages
+
+    def measure(self, requests, seed):
+        rnd = random.Random(seed)
+        reader, urls = self.targets()
+        client = Client()
+        client.force_login(reader)
+        results = {}
+        for name, (url, context_name, param) in urls.items():
+            pages = self.pages(client, url, context_name, param)
+            results[name] = {}
+            for mode in ('cold', 'warm'):
+                cache.clear()
+                latencies = []
+                queries = []
+                for _ in range(requests):
+                    if mode == 'cold':
+                        cache.clear()
+                    page = rnd.choice(pages)
+                    counter = QueryCounter()
+                    with connection.execute_wrapper(counter):
+                        start = time.perf_counter()
+                        response = client.get(page)
+                        latencies.append(
+                            (time.perf_counter() - start) * 1000
+                        )
+                    if response.status_code != 200:
+                        raise RuntimeError(
+                            f'{page}: ответ {response.status_code}'
+                        )
+                    queries.append(counter.count)
+                results[name][mode] = {
+                    'latency_ms': percentiles(latencies),
+                    'queries': round(statistics.mean(queries), 2),
+                    'peak_memory_kb': self.peak_memory(client, url, mode),
+                }
+        return results
+
+    def peak_memory(self, client, url, mode):
+        # Отдельный запрос: под tracemalloc время не показательно.
+        if mode == 'cold':
+            cache.clear()
+        tracemalloc.start()
+        try:
+            client.get(url)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return round(peak / 1024, 1)
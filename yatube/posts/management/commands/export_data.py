@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from posts import export
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоковая выгрузка таблицы в NDJSON или CSV, при желании '
+        'со сжатием gzip. Память не зависит от размера таблицы.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=sorted(export.TABLES))
+        parser.add_argument(
+            '--format', choices=sorted(export.FORMATS), default='ndjson'
+        )
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument(
+            '--batch-size', type=int, default=export.BATCH_SIZE
+        )
+        parser.add_argument(
+            '--output', help='Файл для выгрузки; по умолчанию stdout.'
+        )
+
+    def handle(self, *args, **options):
+        chunks = export.export(
+            options['table'], options['format'], options['gzip'],
+            options['batch_size'],
+        )
+        if options['output']:
+            with open(options['output'], 'wb') as file:
+                file.writelines(chunks)
+            self.stderr.write(f'Выгрузка записана в {options["output"]}')
+        else:
+            sys.stdout.buffer.writelines(chunks)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from sorl.thumbnail.images import ImageFile
+
+from posts.models import Post
+from posts.thumbnails import generate
+
+
+class Command(BaseCommand):
+    help = 'Создаёт все миниатюры для уже загруженных картинок постов.'
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        names = Post.objects.exclude(image='').exclude(
+            image__isnull=True
+        ).values_list('image', flat=True).distinct()
+        done = 0
+        for name in names.iterator():
+            try:
+                generate(ImageFile(name, storage))
+            except Exception as error:
+                self.stderr.write(f'{name}: {error}')
+                continue
+            done += 1
+        self.stdout.write(self.style.SUCCESS(f'Обработано картинок: {done}'))
@@ -0,0 +1,351 @@
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from http.cookiejar import Cookie, CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import (HTTPCookieProcessor, HTTPRedirectHandler,
+                            Request, build_opener)
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import (ThreadedWSGIServer,
+                                          WSGIRequestHandler)
+from django.core.signals import got_request_exception
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from posts import synthetic
+from posts.models import Group, Post, User
+
+from .benchmark_feeds import LOCAL_CACHES, percentiles
+
+DEFAULT_MIX = 'browse=50,feed=25,post=10,comment=10,follow=5'
+
+# Ссылка "дальше": курсор ленты или следующие комментарии поста.
+NEXT_LINK = re.compile(
+    r'href="(\?[^"]*)">\s*Следующая|href="(\?comments=[^"]+)"'
+)
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class NoRedirect(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in Scenarios.names or not weight.isdigit():
+            raise CommandError(f'Неверный сценарий в --mix: {part}')
+        mix[name] = int(weight)
+    return mix
+
+
+class VirtualUser:
+    """Браузер одного пользователя: свои cookie, сессия и CSRF-токен."""
+
+    def __init__(self, base_url, user=None):
+        self.base_url = base_url
+        self.user = user
+        self.cookies = CookieJar()
+        self.opener = build_opener(
+            HTTPCookieProcessor(self.cookies), NoRedirect
+        )
+        self.csrf_token = get_random_string(32)
+        # Следующая страница того, что пользователь сейчас листает.
+        self.next_page = None
+        self.set_cookie(settings.CSRF_COOKIE_NAME, self.csrf_token)
+        if user is not None:
+            session = SessionStore()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.create()
+            self.set_cookie(settings.SESSION_COOKIE_NAME, session.session_key)
+
+    def set_cookie(self, name, value):
+        self.cookies.set_cookie(Cookie(
+            0, name, value, None, False, 'localhost.local', True, False,
+            '/', True, False, None, False, None, None, {},
+        ))
+
+    def open(self, path, data=None):
+        """Код и тело ответа."""
+        body = None
+        headers = {}
+        if data is not None:
+            body = urlencode(data).encode()
+            headers['X-CSRFToken'] = self.csrf_token
+        request = Request(self.base_url + path, body, headers)
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                return response.status, response.read()
+        except HTTPError as error:
+            return error.code, error.read()
+
+    def request(self, path, data=None):
+        return self.open(path, data)[0]
+
+
+class Scenarios:
+    """Действия пользователей; каждое возвращает (адрес, код ответа)."""
+
+    names = ('browse', 'feed', 'post', 'comment', 'follow')
+
+    def __init__(self, rnd, users, groups, posts):
+        self.rnd = rnd
+        self.users = users
+        self.groups = groups
+        self.posts = posts
+
+    def browse(self, client):
+        """Открывает ленту или пост по адресу без параметров и с
+        вероятностью 1/2 листает дальше по ссылкам со страницы.
+        """
+        if client.next_page and self.rnd.random() < 0.5:
+            page = client.next_page
+        else:
+            page = self.start_page()
+        status, body = client.open(page)
+        path = page.partition('?')[0]
+        match = NEXT_LINK.search(body.decode(errors='replace'))
+        client.next_page = None
+        if status == 200 and match:
+            client.next_page = path + (match.group(1) or match.group(2))
+        return path, status
+
+    def start_page(self):
+        return self.rnd.choice([
+            reverse('posts:index'),
+            reverse(
+                'posts:group_list',
+                kwargs={'slug': self.rnd.choice(self.groups)[1]}
+            ),
+            reverse(
+                'posts:profile',
+                kwargs={'username': self.rnd.choice(self.users).username}
+            ),
+            reverse(
+                'posts:post_detail',
+                kwargs={'post_id': self.rnd.choice(self.posts)}
+            ),
+        ])
+
+    def feed(self, client):
+        path = reverse('posts:follow_index')
+        return path, client.request(path)
+
+    def post(self, client):
+        path = reverse('posts:post_create')
+        data = {'text': get_random_string(200)}
+        if self.rnd.random() < 0.5:
+            data['group'] = self.rnd.choice(self.groups)[0]
+        return path, client.request(path, data)
+
+    def comment(self, client):
+        path = reverse(
+            'posts:add_comment',
+            kwargs={'post_id': self.rnd.choice(self.posts)}
+        )
+        return path, client.request(path, {'text': get_random_string(50)})
+
+    def follow(self, client):
+        name = self.rnd.choice(['profile_follow', 'profile_unfollow'])
+        author = self.rnd.choice(self.users).username
+        path = reverse(f'posts:{name}', kwargs={'username': author})
+        return path, client.request(path)
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест: поднимает WSGI-приложение в многопоточном '
+        'сервере на временной базе SQLite в файле и гоняет по нему '
+        'смесь сценариев.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument(
+            '--clients', type=int, default=16,
+            help='Одновременных виртуальных пользователей.'
+        )
+        parser.add_argument(
+            '--duration', type=float, default=30,
+            help='Длительность нагрузки в секундах.'
+        )
+        parser.add_argument(
+            '--mix', default=DEFAULT_MIX,
+            help=f'Веса сценариев, по умолчанию {DEFAULT_MIX}.'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output', help='Файл для JSON; по умолчанию stdout.'
+        )
+
+    @override_settings(CACHES=LOCAL_CACHES)
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        directory = tempfile.mkdtemp()
+        # Файловая база: у каждого потока сервера своё соединение,
+        # как у процессов на боевом сервере.
+        connection.settings_dict['TEST']['NAME'] = os.path.join(
+            directory, 'loadtest.sqlite3'
+        )
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with override_settings(DEBUG=False):
+                synthetic.generate(
+                    users=options['users'],
+                    posts=options['posts'],
+                    comments=options['comments'],
+                    seed=options['seed'],
+                )
+                report = self.run(mix, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(directory, ignore_errors=True)
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(data)
+            self.stderr.write(f'Результат записан в {options["output"]}')
+        else:
+            self.stdout.write(data)
+
+    def run(self, mix, options):
+        from yatube.wsgi import application
+
+        server = ThreadedWSGIServer(('localhost', 0), QuietHandler)
+        server.set_app(application)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.start()
+        base_url = f'http://localhost:{server.server_port}'
+
+        locks = Counter()
+
+        def count_lock(sender, request=None, **kwargs):
+            # Сигнал отправляется внутри обработчика исключения.
+            error = sys.exc_info()[1]
+            if isinstance(error, OperationalError) and 'locked' in str(error):
+                locks[request.path if request else '?'] += 1
+
+        got_request_exception.connect(count_lock)
+        users = list(User.objects.all())
+        scenarios = Scenarios(
+            random.Random(options['seed']),
+            users,
+            list(Group.objects.values_list('pk', 'slug')),
+            list(Post.objects.values_list('pk', flat=True)),
+        )
+        latencies = defaultdict(list)
+        statuses = defaultdict(Counter)
+        failures = Counter()
+        deadline = time.monotonic() + options['duration']
+
+        def client_loop(number):
+            rnd = random.Random(options['seed'] + number)
+            anonymous = VirtualUser(base_url)
+            member = VirtualUser(base_url, rnd.choice(users))
+            names, weights = zip(*mix.items())
+            while time.monotonic() < deadline:
+                name = rnd.choices(names, weights)[0]
+                client = anonymous if name == 'browse' else member
+                start = time.perf_counter()
+                try:
+                    _, status = getattr(scenarios, name)(client)
+                except (URLError, OSError) as error:
+                    failures[f'{name}: {error}'] += 1
+                    status = 'error'
+                latencies[name].append((time.perf_counter() - start) * 1000)
+                statuses[name][status] += 1
+
+        clients = [
+            threading.Thread(target=client_loop, args=(number,))
+            for number in range(options['clients'])
+        ]
+        started = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        server.shutdown()
+        server.server_close()
+        server_thread.join()
+        got_request_exception.disconnect(count_lock)
+        return self.summary(
+            mix, options, elapsed, latencies, statuses, failures, locks
+        )
+
+    def summary(self, mix, options, elapsed, latencies, statuses,
+                failures, locks):
+        def errors(counter):
+            return sum(
+                count for status, count in counter.items()
+                if status == 'error' or status >= 400
+            )
+
+        total = sum(len(values) for values in latencies.values())
+        everything = [value for values in latencies.values()
+                      for value in values]
+        return {
+            'params': {
+                'clients': options['clients'],
+                'duration': options['duration'],
+                'mix': mix,
+                'users': options['users'],
+                'posts': options['posts'],
+                'seed': options['seed'],
+            },
+            'elapsed_seconds': round(elapsed, 2),
+            'requests': total,
+            'throughput_rps': round(total / elapsed, 1),
+            'error_rate': round(
+                sum(errors(counter) for counter in statuses.values())
+                / max(total, 1), 4
+            ),
+            'latency_ms': percentiles(everything) if total > 1 else {},
+            'database_locked': sum(locks.values()),
+            'database_locked_by_path': dict(locks),
+            'scenarios': {
+                name: {
+                    'requests': len(values),
+                    'statuses': {
+                        str(status): count
+                        for status, count in statuses[name].items()
+                    },
+                    'error_rate': round(
+                        errors(statuses[name]) / len(values), 4
+                    ),
+                    'latency_ms': (
+                        percentiles(values) if len(values) > 1 else {}
+                    ),
+                }
+                for name, values in latencies.items()
+            },
+            'client_errors': dict(failures),
+        }
@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+READS = ('browse', 'feed')
+WRITES = ('post', 'comment', 'follow')
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает нагрузочный тест на SQLite с настройками по умолчанию '
+        'и с SQLITE_PRAGMAS: пропускную способность чтения и записи, '
+        'задержки и ошибки блокировки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=20)
+        parser.add_argument(
+            '--mix', default='browse=40,feed=20,post=15,comment=15,follow=10'
+        )
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--output', help='Файл для JSON; по умолчанию stdout.'
+        )
+
+    def handle(self, *args, **options):
+        loadtest_options = {
+            key: options[key]
+            for key in ('clients', 'duration', 'mix', 'users', 'posts', 'seed')
+        }
+        report = {}
+        variants = [('default', {}), ('tuned', settings.SQLITE_PRAGMAS)]
+        for name, pragmas in variants:
+            self.stderr.write(f'Прогон {name}: {pragmas or "без PRAGMA"}')
+            with override_settings(SQLITE_PRAGMAS=pragmas):
+                report[name] = self.loadtest(loadtest_options)
+            report[name]['pragmas'] = pragmas
+        report['change'] = {
+            key: round(report['tuned'][key] / report['default'][key], 2)
+            for key in ('reads_rps', 'writes_rps')
+            if report['default'][key]
+        }
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(data)
+            self.stderr.write(f'Результат записан в {options["output"]}')
+        else:
+            self.stdout.write(data)
+
+    def loadtest(self, options):
+        handle, path = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        try:
+            call_command(
+                'loadtest', output=path, stderr=StringIO(), **options
+            )
+            with open(path) as file:
+                result = json.load(file)
+        finally:
+            os.remove(path)
+        scenarios = result['scenarios']
+        elapsed = result['elapsed_seconds']
+
+        def rate(names):
+            done = sum(
+                scenarios[name]['requests']
+                for name in names if name in scenarios
+            )
+            return round(done / elapsed, 1)
+
+        return {
+            'reads_rps': rate(READS),
+            'writes_rps': rate(WRITES),
+            'throughput_rps': result['throughput_rps'],
+            'error_rate': result['error_rate'],
+            'latency_ms': result['latency_ms'],
+            'write_latency_ms': {
+                name: scenarios[name]['latency_ms']
+                for name in WRITES if name in scenarios
+            },
+            'database_locked': result['database_locked'],
+        }
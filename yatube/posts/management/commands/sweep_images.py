@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts.images import sweep_images
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет картинки постов, на которые не ссылается ни один пост, '
+        'вместе с миниатюрами.'
+    )
+
+    def handle(self, *args, **options):
+        removed = sweep_images()
+        self.stdout.write(self.style.SUCCESS(f'Удалено картинок: {removed}'))
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+# Последнее слово запроса ищется как префикс. Без индекса префиксов
+# FTS5 сливает списки всех слов с этим началом, и короткий префикс
+# читает почти весь индекс. Префиксы в 2 и 3 символа хранятся
+# отдельно, более длинные встречаются в немногих словах.
+#
+# Триггеры из 0015 обращаются к таблице по имени и переживают её
+# пересоздание.
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE posts_post_fts USING fts5(
+    text,
+    content='posts_post',
+    content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'{prefix}
+)
+"""
+
+
+def recreate_index(prefix):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        schema_editor.execute('DROP TABLE IF EXISTS posts_post_fts')
+        schema_editor.execute(CREATE_INDEX.format(prefix=prefix))
+        schema_editor.execute(
+            "INSERT INTO posts_post_fts(posts_post_fts) VALUES ('rebuild')"
+        )
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_post_search_model'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            recreate_index(",\n    prefix='2 3'"), recreate_index('')
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.db import models
-from django.db.models import UniqueConstraint
+from django.db.models import Lookup, UniqueConstraint
+
+from .storage import post_image_storage
 
 User = get_user_model()
 
@@ -43,15 +45,76 @@ class Post(models.Model):
         help_text='Картинка',
         verbose_name='Картинка',
         upload_to='posts/',
+        storage=post_image_storage,
         blank=True, null=True
     )
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Комментариев'
+    )
 
     def __str__(self):
         return self.text[:15]
 
     class Meta:
         default_related_name = 'posts'
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', 'id']
+        indexes = [
+            models.Index(
+                fields=['author', '-pub_date'],
+                name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['group', '-pub_date'],
+                name='post_group_pub_date_idx'
+            ),
+            models.Index(
+                fields=['-pub_date', 'id'],
+                name='post_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['image'],
+                name='post_image_idx'
+            ),
+        ]
+
+
+class SearchDocumentField(models.TextField):
+    """Скрытый столбец FTS5 с именем таблицы: левая часть MATCH."""
+
+
+@SearchDocumentField.register_lookup
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class PostSearch(models.Model):
+    """Полнотекстовый индекс постов (FTS5, только SQLite).
+
+    Таблицу и триггеры создают миграции 0015 и 0017, модель нужна для
+    соединения с постами в запросах. rank - релевантность bm25,
+    она есть только в запросе с MATCH.
+    """
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        db_constraint=False,
+        related_name='search',
+    )
+    document = SearchDocumentField(db_column='posts_post_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'posts_post_fts'
 
 
 class Comment(models.Model):
@@ -77,7 +140,13 @@ class Comment(models.Model):
     )
 
     class Meta:
-        ordering = ['created']
+        ordering = ['created', 'id']
+        indexes = [
+            models.Index(
+                fields=['post', 'created'],
+                name='comment_post_created_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.text
@@ -102,3 +171,60 @@ class Follow(models.Model):
                 name='unique_following'
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=['author', 'user'],
+                name='follow_author_user_idx'
+            ),
+        ]
+
+
+class UserCounters(models.Model):
+    """Счётчики пользователя, которые иначе пришлось бы считать COUNT(*)."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='counters',
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Постов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписчиков'
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписок'
+    )
+
+
+class TimelineEntry(models.Model):
+    """Запись ленты подписок, разложенная по читателям при публикации."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+    )
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_timeline_entry'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date'],
+                name='timeline_user_pub_date_idx'
+            ),
+        ]
@@ -0,0 +1,115 @@
+import re
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+
+SEARCH_TABLE = 'posts_post_fts'
+
+
+def match_phrases(query):
+    """Слова запроса в синтаксисе FTS5 и последнее слово как префикс
+    (None, если в нём один символ).
+
+    Слова берутся в кавычки, поэтому операторы FTS5 во вводе
+    не ломают запрос.
+    """
+    words = re.findall(r'\w+', query)
+    phrases = [f'"{word}"' for word in words]
+    prefix = None
+    if words and len(words[-1]) >= 2:
+        prefix = phrases[-1] + '*'
+    return phrases, prefix
+
+
+def match_expression(query):
+    """Запрос пользователя в синтаксисе FTS5: все слова, последнее -
+    как префикс.
+    """
+    phrases, prefix = match_phrases(query)
+    if prefix:
+        phrases[-1] = prefix
+    return ' '.join(phrases) or None
+
+
+def normalize_query(query):
+    """Запрос в каноническом виде: слова в нижнем регистре через пробел."""
+    return ' '.join(re.findall(r'\w+', query.lower()))
+
+
+def cache_search(request):
+    """Кэшировать ли страницу поиска.
+
+    Только первые страницы коротких запросов в каноническом виде:
+    случайные длинные запросы не должны вытеснять из кэша ленты.
+    """
+    query = request.GET.get('q', '')
+    return (
+        set(request.GET) <= {'q'}
+        and query == normalize_query(query)
+        and len(query.split()) <= settings.SEARCH_CACHE_MAX_WORDS
+    )
+
+
+def has_index():
+    return connection.vendor == 'sqlite'
+
+
+def match_counts(phrases, using):
+    """Число постов с каждой фразой, но не больше
+    SEARCH_RANK_MAX_MATCHES + 1.
+
+    FTS5 отдаёт совпадения слова по одному, поэтому подсчёт до порога
+    стоит одинаково и для редких, и для частых слов.
+    """
+    limit = settings.SEARCH_RANK_MAX_MATCHES + 1
+    counts = ' UNION ALL '.join([
+        f'SELECT count(*) FROM (SELECT 1 FROM {SEARCH_TABLE} '
+        f'WHERE {SEARCH_TABLE} MATCH %s LIMIT %s)'
+    ] * len(phrases))
+    params = [param for phrase in phrases for param in (phrase, limit)]
+    with connections[using].cursor() as cursor:
+        cursor.execute(counts, params)
+        return [count for count, in cursor.fetchall()]
+
+
+def search_posts(posts, query):
+    """Посты по запросу, от самых релевантных по bm25.
+
+    bm25 читает все посты с каждым словом запроса, поэтому, если
+    какое-то слово есть больше чем в SEARCH_RANK_MAX_MATCHES постах,
+    результаты идут от новых к старым: FTS5 отдаёт их в порядке rowid
+    и останавливается на размере страницы.
+
+    Префикс FTS5 тоже читает все посты со всеми словами, которые с него
+    начинаются. Последнее слово ищется префиксом, только если как целое
+    слово оно редкое: частое слово пользователь, скорее всего, дописал.
+
+    Обе сортировки годятся для пагинации курсором.
+    """
+    phrases, prefix = match_phrases(query)
+    if not phrases:
+        return posts.none()
+    if not has_index():
+        return posts.filter(text__icontains=query)
+    counts = match_counts(phrases, posts.db)
+    if prefix and counts[-1] <= settings.SEARCH_RANK_MAX_MATCHES:
+        phrases[-1] = prefix
+        counts[-1] = match_counts([prefix], posts.db)[0]
+    posts = posts.filter(search__document__match=' '.join(phrases))
+    if max(counts) > settings.SEARCH_RANK_MAX_MATCHES:
+        return posts.annotate(search_id=F('search__post')).order_by(
+            '-search_id'
+        )
+    return posts.annotate(search_rank=F('search__rank')).order_by(
+        'search_rank', 'id'
+    )
+
+
+def matching_ids(query):
+    """Подзапрос id постов по запросу, для фильтра pk__in."""
+    return RawSQL(
+        f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s',
+        [match_expression(query)],
+    )
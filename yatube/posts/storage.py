@@ -0,0 +1,51 @@
+import hashlib
+import os
+import posixpath
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранит файл под именем из SHA-256 его содержимого.
+
+    Одинаковые картинки занимают на диске один файл, и sorl-thumbnail
+    делает для них один набор миниатюр. Файл удаляется, только когда
+    на него не ссылается ни один пост (см. posts.images.release_image).
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Имя всё равно заменяется хэшем в _save.
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        extension = posixpath.splitext(name)[1].lower()
+        name = posixpath.join(
+            posixpath.dirname(name), digest[:2], digest[2:4],
+            digest + extension,
+        )
+        if self.exists(name):
+            # Свежее время изменения говорит release_image, что файл
+            # снова нужен, хотя пост с ним ещё не сохранён.
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                # Файл как раз удаляют: записываем его заново.
+                pass
+        # Пишем во временный файл и атомарно переименовываем: параллельная
+        # загрузка той же картинки просто перезапишет его тем же содержимым.
+        temporary = super()._save(f'{name}.{uuid.uuid4().hex}.part', content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+
+post_image_storage = ContentAddressedStorage()
@@ -0,0 +1,106 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+from faker import Faker
+
+from .bulk import BATCH_SIZE, explicit_dates, refresh_derived
+from .models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+def power_law_weights(size, alpha):
+    """Веса по закону Ципфа: k-й по популярности встречается в k^alpha
+    раз реже первого.
+    """
+    return [1 / rank ** alpha for rank in range(1, size + 1)]
+
+
+def generate(users=100, groups=10, posts=1000, comments=2000,
+             follows=10, alpha=1.2, days=365, seed=0):
+    """Заполняет базу правдоподобными данными для замеров.
+
+    Популярность авторов, подписки и комментарии распределены по
+    степенному закону: немного авторов со множеством подписчиков
+    и длинный хвост почти без них. follows - среднее число подписок
+    на пользователя.
+    """
+    rnd = random.Random(seed)
+    fake = Faker('ru_RU')
+    fake.seed_instance(seed)
+    now = timezone.now()
+    # Хэш пароля считается долго, а для замеров хватит одного на всех.
+    password = make_password('benchmark')
+    User.objects.bulk_create(
+        (
+            User(
+                username=f'{fake.user_name()}{index}',
+                first_name=fake.first_name(),
+                last_name=fake.last_name(),
+                password=password,
+            )
+            for index in range(users)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    Group.objects.bulk_create(
+        (
+            Group(
+                title=fake.sentence(nb_words=3)[:200],
+                slug=f'group-{index}',
+                description=fake.paragraph(),
+            )
+            for index in range(groups)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    user_ids = list(User.objects.values_list('pk', flat=True))
+    group_ids = list(Group.objects.values_list('pk', flat=True)) + [None]
+    weights = power_law_weights(len(user_ids), alpha)
+
+    def random_date():
+        return now - timedelta(seconds=rnd.randrange(days * 24 * 60 * 60))
+
+    with explicit_dates():
+        Post.objects.bulk_create(
+            (
+                Post(
+                    author_id=rnd.choices(user_ids, weights)[0],
+                    group_id=rnd.choice(group_ids),
+                    text=fake.paragraph(nb_sentences=5),
+                    pub_date=random_date(),
+                )
+                for _ in range(posts)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        post_ids = list(Post.objects.values_list('pk', flat=True))
+        post_weights = power_law_weights(len(post_ids), alpha)
+        Comment.objects.bulk_create(
+            (
+                Comment(
+                    post_id=rnd.choices(post_ids, post_weights)[0],
+                    author_id=rnd.choice(user_ids),
+                    text=fake.sentence(),
+                    created=random_date(),
+                )
+                for _ in range(comments)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+    Follow.objects.bulk_create(
+        (
+            Follow(user_id=user_id, author_id=author_id)
+            for user_id in user_ids
+            for author_id in set(rnd.choices(
+                user_ids, weights, k=rnd.randint(0, 2 * follows)
+            ))
+            if author_id != user_id
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    refresh_derived()
@@ -0,0 +1,67 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from core.metrics import record_cache
+from posts.caching import get_versions
+
+register = template.Library()
+
+CARD_KEY = 'post_card:{}:{}:{}'
+
+
+def card_scopes(post):
+    scopes = [f'post:{post.pk}', f'author:{post.author.username}']
+    if post.group_id:
+        scopes.append(f'group:{post.group.slug}')
+    return scopes
+
+
+def render_card(context, post, template_name):
+    return render_to_string(
+        template_name, {'post': post, 'group': context.get('group')}
+    )
+
+
+@register.simple_tag(takes_context=True)
+def post_cards(context, posts, *template_names):
+    """Достаёт карточки постов страницы из кэша одним запросом.
+
+    Недостающие карточки рендерятся и кладутся в кэш,
+    а выводит их тег post_card.
+    """
+    posts = list(posts)
+    scopes = sorted({scope for post in posts for scope in card_scopes(post)})
+    versions = dict(zip(scopes, get_versions(scopes)))
+    in_group = int(context.get('group') is not None)
+    keys = {}
+    for post in posts:
+        token = '.'.join(str(versions[scope]) for scope in card_scopes(post))
+        for template_name in template_names:
+            keys[(template_name, post)] = CARD_KEY.format(
+                template_name, post.pk, f'{token}.{in_group}'
+            )
+    found = cache.get_many(keys.values())
+    record_cache(hits=len(found), misses=len(keys) - len(found))
+    cards = {}
+    missing = {}
+    for (template_name, post), key in keys.items():
+        if key not in found:
+            found[key] = missing[key] = render_card(
+                context, post, template_name
+            )
+        cards[(template_name, post.pk)] = found[key]
+    cache.set_many(missing, settings.POST_CARD_CACHE_TIMEOUT)
+    context['post_cards'] = cards
+    return ''
+
+
+@register.simple_tag(takes_context=True)
+def post_card(context, post, template_name):
+    cards = context.get('post_cards') or {}
+    card = cards.get((template_name, post.pk))
+    if card is None:
+        card = render_card(context, post, template_name)
+    return mark_safe(card)
@@ -0,0 +1,40 @@
+from django import template
+
+from posts.thumbnails import ready_thumbnail, ready_thumbnails
+
+register = template.Library()
+
+CARD_SIZES = '(max-width: 960px) 100vw, 960px'
+
+
+@register.simple_tag
+def post_thumbnail(post, preset='card'):
+    """Миниатюра из фоновой очереди; пока её нет - None."""
+    if not post.image:
+        return None
+    return ready_thumbnail(post, preset)
+
+
+def srcset(thumbnails):
+    return ', '.join(f'{im.url} {im.width}w' for im in thumbnails)
+
+
+@register.inclusion_tag('includes/post_picture.html')
+def post_picture(post, preset='card', sizes=CARD_SIZES):
+    """Картинка поста с srcset нескольких ширин и форматов.
+
+    Пока миниатюры создаются, выводится исходная картинка.
+    """
+    context = {'post': post, 'sizes': sizes}
+    if not post.image:
+        return context
+    ready = ready_thumbnails(post, preset)
+    if ready:
+        fallback = ready.pop(None)
+        context['image'] = fallback[0]
+        context['srcset'] = srcset(fallback)
+        context['sources'] = [
+            {'type': f'image/{format_.lower()}', 'srcset': srcset(images)}
+            for format_, images in ready.items()
+        ]
+    return context
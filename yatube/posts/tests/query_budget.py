@@ -0,0 +1,63 @@
+import os
+import re
+from abc import ABC, abstractmethod
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# Объёмы данных, на которых сравнивается число запросов.
+# QUERY_BUDGET_SIZES=10,1000,100000 - прогон на больших объёмах.
+# Объём, близкий к рабочей базе, проверяется всегда, но только на
+# главных лентах: прогон всех вьюх на нём занимает минуту.
+REALISTIC_SIZE = 20_000
+SIZES = [
+    int(size)
+    for size in os.getenv('QUERY_BUDGET_SIZES', '10,1000').split(',')
+]
+
+
+def shape(sql):
+    """SQL без значений: запросы, различающиеся только id, совпадают."""
+    return re.sub(r"'[^']*'|\b\d+\b", '?', sql)
+
+
+class QueryBudgetMixin(ABC):
+    """Проверка, что число запросов вьюхи не зависит от объёма данных.
+
+    Наследник обязан реализовать seed(size), который дополняет базу
+    до size постов; размеры перебираются по возрастанию.
+    """
+    query_budget_sizes = SIZES
+
+    @abstractmethod
+    def seed(self, size):
+        """Дополнить базу до size постов."""
+
+    def assertQueryBudget(self, client, url, budget, sizes=None):
+        runs = {}
+        for size in sorted(sizes or self.query_budget_sizes):
+            self.seed(size)
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            runs[size] = [query['sql'] for query in queries.captured_queries]
+        smallest, largest = runs[min(runs)], runs[max(runs)]
+        if len(largest) <= budget and len(largest) == len(smallest):
+            return
+        lines = [
+            f'{url}: {size} постов - {len(sqls)} запросов'
+            for size, sqls in runs.items()
+        ]
+        lines.append(f'Бюджет: {budget}')
+        grown = Counter(map(shape, largest)) - Counter(map(shape, smallest))
+        if grown:
+            lines.append('Запросы, число которых растёт с данными:')
+            lines += [f'  {count} x {sql}' for sql, count in grown.items()]
+        lines.append(f'Запросы при {max(runs)} постах:')
+        lines += [
+            f'  {number}. {sql}' for number, sql in enumerate(largest, 1)
+        ]
+        self.fail('\n'.join(lines))
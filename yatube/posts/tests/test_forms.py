@@ -1,12 +1,19 @@
 import shutil
 import tempfile
 from http import HTTPStatus
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
-from django.test import Client, TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
 from django.urls import reverse
+from PIL import Image
+from PIL.PngImagePlugin import PngImageFile
 from posts.models import Comment, Group, Post
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -208,3 +215,162 @@ class ComentTest(TestCase):
             response,
             f'/auth/login/?next=/posts/{post.id}/comment/'
         )
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    POST_IMAGE_MAX_SIZE=(100, 100),
+    POST_THUMBNAIL_WORKERS=0,
+)
+class ImageNormalizationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='IvanTest')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_uploaded_image_is_capped_and_stripped(self):
+        """Картинка уменьшается, поворачивается по EXIF и теряет метаданные."""
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: повернуть на 90° по часовой
+        exif[0x010F] = 'Camera'
+        source = BytesIO()
+        Image.new('RGB', (400, 200), 'red').save(
+            source, 'JPEG', exif=exif.tobytes()
+        )
+        response = self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Пост с фотографией',
+                'image': SimpleUploadedFile(
+                    'photo.jpeg', source.getvalue(), content_type='image/jpeg'
+                ),
+            },
+        )
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        post = Post.objects.get(text='Пост с фотографией')
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        with Image.open(post.image) as image:
+            self.assertEqual(image.size, (50, 100))
+            self.assertEqual(len(image.getexif()), 0)
+
+    def post_image(self, name, content, content_type):
+        return self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'Пост',
+                'image': SimpleUploadedFile(
+                    name, content, content_type=content_type
+                ),
+            },
+        )
+
+    def test_broken_image_is_form_error(self):
+        """Обрезанная картинка - ошибка формы, а не ошибка сервера."""
+        source = BytesIO()
+        Image.effect_noise((400, 200), 50).save(source, 'JPEG')
+        # Заголовок цел, и ImageField файл пропускает, но данных
+        # на всю картинку не хватает.
+        broken = source.getvalue()[:len(source.getvalue()) // 2]
+        response = self.post_image('broken.jpeg', broken, 'image/jpeg')
+        self.assertFormError(
+            response, 'form', 'image', 'Не удалось обработать картинку.'
+        )
+        self.assertFalse(Post.objects.filter(text='Пост').exists())
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=100)
+    def test_huge_image_is_rejected_before_decoding(self):
+        """Слишком большая картинка отклоняется без декодирования."""
+        source = BytesIO()
+        Image.new('RGB', (20, 20), 'red').save(source, 'PNG')
+        with mock.patch.object(PngImageFile, 'load') as load:
+            response = self.post_image(
+                'huge.png', source.getvalue(), 'image/png'
+            )
+        self.assertFormError(
+            response, 'form', 'image', 'Картинка слишком большая: 20x20.'
+        )
+        load.assert_not_called()
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    POST_THUMBNAIL_WORKERS=0,
+    POST_IMAGE_RELEASE_GRACE=0,
+)
+class ImageDeduplicationTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='IvanTest')
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        source = BytesIO()
+        Image.new('RGB', (10, 10), 'blue').save(source, 'PNG')
+        self.image = source.getvalue()
+
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, text, filename):
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': text,
+                'image': SimpleUploadedFile(
+                    filename, self.image, content_type='image/png'
+                ),
+            },
+        )
+        return Post.objects.get(text=text)
+
+    def test_identical_images_share_one_file(self):
+        """Одинаковые картинки хранятся одним файлом до последней ссылки."""
+        first = self.create_post('Первый', 'one.png')
+        second = self.create_post('Второй', 'two.png')
+        self.assertEqual(first.image.name, second.image.name)
+        storage = first.image.storage
+        name = first.image.name
+        first.delete()
+        self.assertTrue(storage.exists(name))
+        second.delete()
+        self.assertFalse(storage.exists(name))
+
+    def test_recently_uploaded_image_waits_for_sweep(self):
+        """Недавно загруженный файл удаляет только sweep_images."""
+        post = self.create_post('Пост', 'one.png')
+        storage = post.image.storage
+        name = post.image.name
+        with override_settings(POST_IMAGE_RELEASE_GRACE=600):
+            post.delete()
+            self.assertTrue(storage.exists(name))
+            call_command('sweep_images', stdout=StringIO())
+            self.assertTrue(storage.exists(name))
+        call_command('sweep_images', stdout=StringIO())
+        self.assertFalse(storage.exists(name))
+
+    def test_replaced_image_is_released(self):
+        """Заменённая при редактировании картинка удаляется с диска."""
+        post = self.create_post('Пост', 'one.png')
+        old_name = post.image.name
+        source = BytesIO()
+        Image.new('RGB', (10, 10), 'green').save(source, 'PNG')
+        self.authorized_client.post(
+            reverse('posts:post_edit', kwargs={'post_id': post.pk}),
+            data={
+                'text': 'Пост',
+                'image': SimpleUploadedFile(
+                    'two.png', source.getvalue(), content_type='image/png'
+                ),
+            },
+        )
+        post.refresh_from_db()
+        self.assertNotEqual(post.image.name, old_name)
+        self.assertFalse(post.image.storage.exists(old_name))
+        self.assertTrue(post.image.storage.exists(post.image.name))
@@ -1,7 +1,19 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
 
-from posts.models import Group, Post
+from posts import synthetic
+from posts.caching import get_versions
+from posts.models import Comment, Follow, Group, Post, UserCounters
+from posts.timeline import timeline_posts
+from posts.utils import CursorPaginator
 
 User = get_user_model()
 
@@ -38,3 +50,265 @@ class PostModelTest(TestCase):
         for model_str, model in models.items():
             with self.subTest(model=model):
                 self.assertEqual(model_str, str(model))
+
+
+class FeedIndexTests(TestCase):
+    """Запросы лент читают индексы, а не сортируют таблицу."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            group=cls.group,
+            text='Тестовый пост',
+        )
+
+    def test_feed_queries_use_indexes(self):
+        """Ленты, комментарии и подписки выбираются по своим индексам."""
+        pub_date = self.post.pub_date
+        queries = {
+            'post_pub_date_id_idx': Post.objects.select_related(
+                'group', 'author'
+            ),
+            'post_author_pub_date_idx': self.user.posts.filter(
+                pub_date__lt=pub_date
+            ),
+            'post_group_pub_date_idx': self.group.posts.select_related(
+                'group', 'author'
+            ),
+            'comment_post_created_idx': self.post.comments.select_related(
+                'author'
+            ),
+            'follow_author_user_idx': Follow.objects.filter(
+                author=self.user
+            ),
+            'timeline_user_pub_date_idx': timeline_posts(self.user),
+        }
+        for index, queryset in queries.items():
+            with self.subTest(index=index):
+                plan = queryset[:10].explain()
+                self.assertIn(index, plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_cursor_pages_seek_by_index(self):
+        """Следующая страница ищет по индексу, а не сканирует ленту."""
+        Comment.objects.create(
+            post=self.post, author=self.user, text='Комментарий'
+        )
+        queries = {
+            'post_pub_date_id_idx': Post.objects.select_related(
+                'group', 'author'
+            ),
+            'post_author_pub_date_idx': self.user.posts.all(),
+            'post_group_pub_date_idx': self.group.posts.select_related(
+                'group', 'author'
+            ),
+            'comment_post_created_idx': self.post.comments.select_related(
+                'author'
+            ),
+        }
+        for index, queryset in queries.items():
+            with self.subTest(index=index):
+                paginator = CursorPaginator(queryset, 10)
+                values = paginator._position(queryset.first())
+                seek = queryset.order_by(*paginator.ordering).filter(
+                    paginator._seek(values, reverse=False)
+                )
+                plan = seek[:11].explain()
+                self.assertRegex(plan, rf'SEARCH .*{index} \([^)]*[<>]')
+                self.assertNotIn('TEMP B-TREE', plan)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def counters(self, user):
+        return UserCounters.objects.get(user=user)
+
+    def test_counters_follow_posts_comments_and_follows(self):
+        """Счётчики меняются при создании и удалении записей."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий'
+        )
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        post.refresh_from_db()
+        self.assertEqual(self.counters(self.author).posts_count, 1)
+        self.assertEqual(self.counters(self.author).followers_count, 1)
+        self.assertEqual(self.counters(self.reader).following_count, 1)
+        self.assertEqual(post.comments_count, 1)
+        comment.delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertEqual(self.counters(self.author).followers_count, 0)
+        self.assertEqual(self.counters(self.reader).following_count, 0)
+        post.delete()
+        self.assertEqual(self.counters(self.author).posts_count, 0)
+
+    def test_delete_author_with_posts_and_follows(self):
+        """Удаление автора не пересоздаёт его счётчики."""
+        author = User.objects.create_user(username='leaving')
+        Post.objects.create(author=author, text='Пост')
+        Follow.objects.create(user=self.reader, author=author)
+        Follow.objects.create(user=author, author=self.author)
+        author_id = author.pk
+        author.delete()
+        self.assertFalse(UserCounters.objects.filter(user_id=author_id))
+        self.assertEqual(self.counters(self.reader).following_count, 0)
+        self.assertEqual(self.counters(self.author).followers_count, 0)
+
+    def test_recount_command_fixes_drift(self):
+        """Команда recount_counters пересчитывает счётчики заново."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Comment.objects.create(post=post, author=self.reader, text='Текст')
+        Follow.objects.create(user=self.reader, author=self.author)
+        UserCounters.objects.update(
+            posts_count=7, followers_count=7, following_count=7
+        )
+        Post.objects.update(comments_count=7)
+        UserCounters.objects.filter(user=self.reader).delete()
+        call_command('recount_counters', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        author = self.counters(self.author)
+        reader = self.counters(self.reader)
+        self.assertEqual(
+            (author.posts_count, author.followers_count,
+             author.following_count),
+            (1, 1, 0)
+        )
+        self.assertEqual(
+            (reader.posts_count, reader.followers_count,
+             reader.following_count),
+            (0, 0, 1)
+        )
+
+
+class SyntheticDataTest(TestCase):
+    def test_generate(self):
+        """Генератор создаёт данные с согласованными счётчиками и лентами,
+        а подписки сосредоточены на немногих авторах.
+        """
+        synthetic.generate(
+            users=30, groups=3, posts=200, comments=300, follows=5
+        )
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 300)
+        self.assertGreater(
+            Post.objects.values('pub_date').distinct().count(), 100
+        )
+        top = UserCounters.objects.order_by('-followers_count')
+        self.assertGreater(
+            top[0].followers_count, top[len(top) // 2].followers_count
+        )
+        reader = UserCounters.objects.order_by('-following_count')[0].user
+        self.assertEqual(
+            timeline_posts(reader).count(),
+            Post.objects.filter(author__following__user=reader).count(),
+        )
+
+
+class SqlitePragmasTest(TestCase):
+    def test_connection_pragmas(self):
+        """Соединение с SQLite получает настройки из SQLITE_PRAGMAS."""
+        with connection.cursor() as cursor:
+            for name in ('busy_timeout', 'cache_size'):
+                cursor.execute(f'PRAGMA {name}')
+                self.assertEqual(
+                    cursor.fetchone()[0], settings.SQLITE_PRAGMAS[name]
+                )
+
+
+class BulkImportTest(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def load(self, table, content, name):
+        call_command(
+            'import_data', table, self.write(name, content),
+            stdout=StringIO(),
+        )
+
+    def test_import_keeps_dates_and_follow_uniqueness(self):
+        """Импорт сохраняет даты, пропускает повторные подписки,
+        пересчитывает счётчики и ленты и возвращает индексы.
+        """
+        self.load('users', (
+            '{"id": 10, "username": "author"}\n'
+            '{"id": 11, "username": "reader", "first_name": "Иван"}\n'
+        ), 'users.ndjson')
+        self.load('posts', (
+            'id,author_id,group_id,pub_date,text\n'
+            '1,10,,2020-01-02T03:04:05.123456+00:00,"Пост, с запятой"\n'
+            '2,10,,,Без даты\n'
+        ), 'posts.csv')
+        self.load('follows', (
+            '{"user_id": 11, "author_id": 10}\n'
+            '{"user_id": 11, "author_id": 10}\n'
+        ), 'follows.ndjson')
+        post = Post.objects.get(pk=1)
+        self.assertEqual(post.text, 'Пост, с запятой')
+        self.assertEqual(
+            post.pub_date.isoformat(), '2020-01-02T03:04:05.123456+00:00'
+        )
+        self.assertIsNotNone(Post.objects.get(pk=2).pub_date)
+        self.assertEqual(Follow.objects.count(), 1)
+        reader = User.objects.get(username='reader')
+        self.assertFalse(reader.has_usable_password())
+        self.assertEqual(reader.counters.following_count, 1)
+        self.assertEqual(timeline_posts(reader).count(), 2)
+        # Автоинкремент сдвинут за самый большой загруженный id.
+        self.assertGreater(User.objects.create(username='new').pk, 11)
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Post._meta.db_table
+            )
+        self.assertIn('post_author_pub_date_idx', constraints)
+
+    def test_import_refreshes_only_touched_rows(self):
+        """Пересчитываются только затронутые загрузкой авторы,
+        кэш остальных лент не сбрасывается.
+        """
+        other = User.objects.create(username='other')
+        UserCounters.objects.filter(user=other).update(posts_count=7)
+        before = get_versions(['feeds', 'index'])
+        self.load('users', '{"id": 1000, "username": "author"}\n',
+                  'users.ndjson')
+        self.load('posts', 'id,author_id,text\n1,1000,Пост\n', 'posts.csv')
+        self.assertEqual(UserCounters.objects.get(pk=1000).posts_count, 1)
+        self.assertEqual(UserCounters.objects.get(user=other).posts_count, 7)
+        feeds, index = get_versions(['feeds', 'index'])
+        self.assertEqual(feeds, before[0])
+        self.assertGreater(index, before[1])
+        self.assertTrue(Post._meta.get_field('pub_date').auto_now_add)
+
+    def test_invalid_row_stops_import(self):
+        """Ошибка в строке прерывает загрузку с понятным сообщением."""
+        with self.assertRaisesMessage(CommandError, 'строка 3, pub_date'):
+            self.load('posts', (
+                'id,author_id,pub_date,text\n'
+                '1,1,,Текст\n'
+                '2,1,вчера,Текст\n'
+            ), 'posts.csv')
+        with self.assertRaisesMessage(CommandError, 'неизвестное поле'):
+            self.load('groups', '{"name": "x"}\n', 'groups.ndjson')
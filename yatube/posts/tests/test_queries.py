@@ -0,0 +1,89 @@
+from django.contrib.auth import get_user_model
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts import counters, timeline
+from posts.models import Comment, Follow, Group, Post
+
+from .query_budget import REALISTIC_SIZE, QueryBudgetMixin
+
+User = get_user_model()
+
+
+class ViewQueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Пост с комментариями'
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def seed(self, size):
+        missing = size - Post.objects.count()
+        Post.objects.bulk_create(
+            Post(author=self.author, group=self.group, text=f'Пост {index}')
+            for index in range(missing)
+        )
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.reader, text=f'Ответ {index}')
+            for index in range(missing)
+        )
+        timeline.backfill(self.reader.pk, self.author.pk)
+        counters.recount_all()
+
+    def test_index(self):
+        """Главная страница: число запросов не растёт с числом постов."""
+        self.assertQueryBudget(self.client, reverse('posts:index'), 4)
+
+    def test_feeds_at_realistic_size(self):
+        """Ленты укладываются в бюджет на объёме рабочей базы."""
+        sizes = (min(self.query_budget_sizes), REALISTIC_SIZE)
+        budgets = {
+            reverse('posts:index'): 4,
+            reverse('posts:follow_index'): 5,
+        }
+        for url, budget in budgets.items():
+            with self.subTest(url=url):
+                self.assertQueryBudget(self.client, url, budget, sizes)
+
+    def test_group_list(self):
+        """Страница группы: число запросов не растёт с числом постов."""
+        url = reverse('posts:group_list', kwargs={'slug': self.group.slug})
+        self.assertQueryBudget(self.client, url, 5)
+
+    def test_profile(self):
+        """Профиль: число запросов не растёт с числом постов."""
+        url = reverse('posts:profile', kwargs={'username': 'author'})
+        self.assertQueryBudget(self.client, url, 6)
+
+    def test_post_detail(self):
+        """Пост: число запросов не растёт с числом комментариев."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        # Пятый запрос - автор поста для ETag.
+        self.assertQueryBudget(self.client, url, 5)
+
+    def test_follow_index(self):
+        """Лента подписок: число запросов не растёт с числом постов."""
+        self.assertQueryBudget(self.client, reverse('posts:follow_index'), 5)
+
+    def test_api(self):
+        """API: число запросов не растёт с числом постов и комментариев."""
+        budgets = {
+            reverse('posts:api_index'): 3,
+            reverse('posts:api_follow'): 4,
+            reverse('posts:api_post_detail', args=(self.post.pk,)): 5,
+        }
+        for url, budget in budgets.items():
+            with self.subTest(url=url):
+                self.assertQueryBudget(self.client, url, budget)
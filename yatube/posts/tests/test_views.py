@@ -1,16 +1,39 @@
+import csv
+import gzip
+import json
+import logging
+import os
 import shutil
 import tempfile
+import threading
+import time
+import warnings
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.management import call_command
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.paginator import Page
-from django.test import Client, TestCase, override_settings
+from django.db import connection, transaction
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from core.db_router import PIN_SESSION_KEY, ReplicaRouter, read_replica
+from PIL import Image
+from posts import thumbnails
+from posts.caching import (LOCK_KEY, Envelope, bump_versions, get_or_build,
+                           get_versions)
 from posts.forms import PostForm
-from posts.models import Follow, Group, Post
+from posts.models import Comment, Follow, Group, Post, TimelineEntry
+from posts.utils import encode_cursor
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 User = get_user_model()
@@ -67,6 +90,66 @@ class PaginatorViewsTest(TestCase):
                     len(response.context.get('page_obj')), count_posts
                 )
 
+    def test_cursor_pages_walk_whole_feed(self):
+        """Курсоры ведут по всей ленте без пропусков и повторов."""
+        expected = list(
+            Post.objects.order_by('-pub_date', 'id').values_list(
+                'id', flat=True
+            )
+        )
+        for page in self.page_list:
+            with self.subTest(page=page):
+                response = self.authorized_client.get(page + '?cursor=')
+                first = response.context.get('page_obj')
+                self.assertFalse(first.has_previous())
+                response = self.authorized_client.get(
+                    page + f'?cursor={first.next_cursor}'
+                )
+                second = response.context.get('page_obj')
+                self.assertFalse(second.has_next())
+                self.assertEqual(
+                    [post.id for post in first] + [post.id for post in second],
+                    expected
+                )
+                response = self.authorized_client.get(
+                    page + f'?cursor={second.previous_cursor}'
+                )
+                self.assertEqual(
+                    [post.id for post in response.context.get('page_obj')],
+                    [post.id for post in first]
+                )
+
+    def test_feeds_link_cursors_by_default(self):
+        """Ленты без параметров листаются курсорами, а не номерами."""
+        for page in self.page_list:
+            with self.subTest(page=page):
+                response = self.guest_client.get(page)
+                page_obj = response.context['page_obj']
+                self.assertContains(
+                    response, f'?cursor={page_obj.next_cursor}'
+                )
+                self.assertNotContains(response, '?page=')
+
+    def test_tampered_cursor_opens_first_page(self):
+        """С испорченным курсором открывается первая страница."""
+        first = list(Post.objects.order_by('-pub_date', 'id'))[
+            :settings.POSTS_ON_PAGE
+        ]
+        cursors = [
+            'abc',
+            encode_cursor('n', ['not-a-date', 1]),
+            encode_cursor('n', [{'a': 1}, 1]),
+            encode_cursor('p', [first[0].pub_date, 'abc']),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                response = self.guest_client.get(
+                    reverse('posts:index'), {'cursor': cursor}
+                )
+                self.assertEqual(
+                    list(response.context['page_obj']), first
+                )
+
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class TaskPagesTests(TestCase):
@@ -98,6 +181,9 @@ class TaskPagesTests(TestCase):
             author=cls.user,
             image=cls.uploaded
         )
+        # Миниатюры готовы заранее, чтобы первый показ страницы не создавал
+        # их и не сбрасывал версии кэша.
+        thumbnails.generate(ImageFile(cls.post.image))
         cls.author = User.objects.create(username='author')
         cls.index_url = reverse('posts:index')
         cls.group_list = reverse(
@@ -256,20 +342,35 @@ class TaskPagesTests(TestCase):
         self.assertNotIn(post_new, context_post)
 
     def test_cache_index(self):
-        """Проверяем, что главная отдает кэшированные данные."""
+        """Главная отдаёт кэш, пока посты не меняются через модели."""
         post = Post.objects.create(
             text='Пост под кеш',
             author=self.author)
         content_add = self.author_client.get(
             reverse('posts:index')).content
+        Post.objects.filter(pk=post.pk).update(text='Тихая правка')
+        content_cached = self.author_client.get(
+            reverse('posts:index')).content
+        self.assertEqual(content_add, content_cached)
         post.delete()
         content_delete = self.author_client.get(
             reverse('posts:index')).content
-        self.assertEqual(content_add, content_delete)
-        cache.clear()
-        content_cache_clear = self.author_client.get(
-            reverse('posts:index')).content
-        self.assertNotEqual(content_add, content_cache_clear)
+        self.assertNotEqual(content_add, content_delete)
+
+    def test_cache_index_shows_new_post_at_once(self):
+        """Новый пост сразу появляется на закэшированной главной."""
+        self.author_client.get(reverse('posts:index'))
+        Post.objects.create(text='Свежий пост', author=self.author)
+        content = self.author_client.get(reverse('posts:index')).content
+        self.assertIn('Свежий пост', content.decode())
+
+    def test_cache_index_not_shared_between_users(self):
+        """Гость не получает страницу, закэшированную для пользователя."""
+        self.author_client.get(reverse('posts:index'))
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertNotIn(
+            reverse('posts:post_create'), response.content.decode()
+        )
 
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
@@ -347,6 +448,15 @@ class FollowTests(TestCase):
         )
         self.assertEqual(Follow.objects.count(), count_follow - 1)
 
+    def test_follow_updates_follower_profile(self):
+        """Профиль подписчика показывает новое число подписок."""
+        url = reverse(
+            'posts:profile', kwargs={'username': self.follower.username}
+        )
+        self.assertContains(self.guest_client.get(url), 'подписок: 0')
+        Follow.objects.create(user=self.follower, author=self.author)
+        self.assertContains(self.guest_client.get(url), 'подписок: 1')
+
     def test_follow_on_authors(self):
         """Проверяем записи избранных авторов."""
         post = Post.objects.create(
@@ -374,3 +484,900 @@ class FollowTests(TestCase):
             reverse('posts:follow_index')
         )
         self.assertNotIn(post, response.context.get('page_obj').object_list)
+
+    def test_new_post_fans_out_to_followers(self):
+        """Новый пост попадает в ленты подписчиков при публикации."""
+        Follow.objects.create(user=self.follower, author=self.author)
+        post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertTrue(
+            TimelineEntry.objects.filter(
+                user=self.follower, post=post
+            ).exists()
+        )
+
+    def test_follow_backfills_and_unfollow_prunes_timeline(self):
+        """Подписка наполняет ленту, отписка очищает её."""
+        Post.objects.create(author=self.author, text='Старый пост')
+        self.follower_client.get(
+            reverse(
+                'posts:profile_follow',
+                kwargs={'username': self.author.username}
+            )
+        )
+        self.assertEqual(self.follower.timeline.count(), 1)
+        self.follower_client.get(
+            reverse(
+                'posts:profile_unfollow',
+                kwargs={'username': self.author.username}
+            )
+        )
+        self.assertEqual(self.follower.timeline.count(), 0)
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0)
+    def test_popular_author_posts_read_on_demand(self):
+        """Посты популярного автора подмешиваются в ленту при чтении."""
+        Follow.objects.create(user=self.follower, author=self.author)
+        post = Post.objects.create(author=self.author, text='Для всех')
+        self.assertFalse(self.follower.timeline.exists())
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertIn(post, response.context.get('page_obj').object_list)
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=1)
+    def test_posts_stay_when_author_loses_popularity(self):
+        """Посты, написанные популярным автором, остаются в лентах,
+        когда подписчиков становится меньше порога.
+        """
+        other = User.objects.create(username='other')
+        Follow.objects.create(user=self.follower, author=self.author)
+        Follow.objects.create(user=other, author=self.author)
+        post = Post.objects.create(author=self.author, text='Для всех')
+        self.assertFalse(self.follower.timeline.exists())
+        Follow.objects.filter(user=other).delete()
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertIn(post, response.context.get('page_obj').object_list)
+
+
+class PostCardCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='IvanTest')
+        cls.post = Post.objects.create(author=cls.user, text='Старый текст')
+
+    def setUp(self):
+        self.guest_client = Client()
+        cache.clear()
+
+    def test_card_cached_until_post_changes(self):
+        """Карточка поста берётся из кэша, пока пост не изменён."""
+        self.guest_client.get(reverse('posts:index'))
+        Post.objects.filter(pk=self.post.pk).update(text='Тихая правка')
+        bump_versions('index')
+        content = self.guest_client.get(reverse('posts:index')).content
+        self.assertIn('Старый текст', content.decode())
+        self.post.text = 'Новый текст'
+        self.post.save()
+        content = self.guest_client.get(reverse('posts:index')).content
+        self.assertIn('Новый текст', content.decode())
+
+    def test_card_invalidated_when_author_changes(self):
+        """Смена имени автора обновляет его карточки."""
+        self.guest_client.get(reverse('posts:index'))
+        self.user.first_name = 'Иван'
+        self.user.last_name = 'Тестов'
+        self.user.save()
+        content = self.guest_client.get(reverse('posts:index')).content
+        self.assertIn('Иван Тестов', content.decode())
+
+
+@override_settings(COMMENTS_ON_PAGE=2)
+class CommentListTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='IvanTest')
+        cls.post = Post.objects.create(author=cls.user, text='Пост')
+        cls.other_post = Post.objects.create(author=cls.user, text='Другой')
+        Comment.objects.create(
+            post=cls.other_post, author=cls.user, text='Чужой комментарий'
+        )
+        for i in range(3):
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text=f'Комментарий {i}'
+            )
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def test_post_detail_shows_only_own_comments(self):
+        """На странице поста только его комментарии, первой порцией."""
+        response = self.guest_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        comments = response.context.get('comments')
+        self.assertEqual(
+            [comment.text for comment in comments],
+            ['Комментарий 0', 'Комментарий 1']
+        )
+        self.assertTrue(comments.has_next())
+
+    def test_load_more_returns_next_batch(self):
+        """JSON-эндпоинт отдаёт следующую порцию комментариев."""
+        response = self.guest_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        cursor = response.context.get('comments').next_cursor
+        response = self.guest_client.get(
+            reverse('posts:post_comments', kwargs={'post_id': self.post.pk}),
+            {'cursor': cursor}
+        )
+        data = response.json()
+        self.assertEqual(
+            [comment['text'] for comment in data['comments']],
+            ['Комментарий 2']
+        )
+        self.assertIsNone(data['next_cursor'])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, POST_THUMBNAIL_WORKERS=0)
+class ThumbnailPipelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='IvanTest')
+        cls.small_gif = (
+            b"\x47\x49\x46\x38\x39\x61\x02\x00"
+            b"\x01\x00\x80\x00\x00\x00\x00\x00"
+            b"\xFF\xFF\xFF\x21\xF9\x04\x00\x00"
+            b"\x00\x00\x00\x2C\x00\x00\x00\x00"
+            b"\x02\x00\x01\x00\x00\x02\x02\x0C"
+            b"\x0A\x00\x3B"
+        )
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        cache.clear()
+
+    def tearDown(self):
+        # Одинаковые картинки хранятся одним файлом: миниатюры прошлого
+        # теста не должны оказаться готовыми в следующем.
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        default.kvstore.clear_local()
+
+    def test_thumbnail_generated_after_upload(self):
+        """После загрузки миниатюра создаётся фоном, а до этого
+        выводится исходная картинка.
+        """
+        post = Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(
+                name='thumb.gif',
+                content=self.small_gif,
+                content_type='image/gif'
+            )
+        )
+        url = reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        content = self.authorized_client.get(url).content.decode()
+        self.assertIn(post.image.url, content)
+        content = self.authorized_client.get(url).content.decode()
+        self.assertNotIn(post.image.url, content)
+        self.assertIn(settings.MEDIA_URL + 'cache/', content)
+
+    def test_picture_has_srcset_and_modern_formats(self):
+        """Картинка выводится с srcset всех ширин и webp-вариантом."""
+        post = Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(
+                name='srcset.gif',
+                content=self.small_gif,
+                content_type='image/gif'
+            )
+        )
+        thumbnails.generate(ImageFile(post.image))
+        url = reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        content = self.authorized_client.get(url).content.decode()
+        for width in (960, 640, 320):
+            self.assertIn(f'.jpg {width}w', content)
+            self.assertIn(f'.webp {width}w', content)
+        self.assertIn('type="image/webp"', content)
+
+    def test_variants_generated_in_one_decode(self):
+        """Все варианты миниатюр создаются из одной декодированной картинки."""
+        post = Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(
+                name='decode.gif',
+                content=self.small_gif,
+                content_type='image/gif'
+            )
+        )
+        source = ImageFile(post.image)
+        with mock.patch.object(
+            default.engine, 'get_image', wraps=default.engine.get_image
+        ) as get_image:
+            thumbnails.generate(source)
+        get_image.assert_called_once()
+        for _, geometry, options in thumbnails.variants():
+            thumbnail, _ = thumbnails.thumbnail_file(source, geometry, options)
+            self.assertTrue(thumbnail.exists())
+
+    def test_feed_prefetches_thumbnails_in_one_lookup(self):
+        """Метаданные миниатюр страницы ленты читаются одним запросом,
+        а при выводе карточек берутся из памяти процесса.
+        """
+        for index in range(3):
+            source = BytesIO()
+            Image.new('RGB', (4, 4), (index, 0, 0)).save(source, 'PNG')
+            post = Post.objects.create(
+                author=self.user,
+                text=f'Пост {index}',
+                image=SimpleUploadedFile(
+                    name=f'feed{index}.png',
+                    content=source.getvalue(),
+                    content_type='image/png'
+                )
+            )
+            thumbnails.ready_thumbnails(post, 'card')
+            thumbnails.ready_thumbnails(post, 'card')
+        default.kvstore.clear_local()
+        cache.clear()
+        posts = list(Post.objects.all())
+        with self.assertNumQueries(1):
+            thumbnails.prefetch(posts)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, 'type="image/webp"', count=3)
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if 'thumbnail_kvstore' in query['sql']
+        ])
+
+
+class RequestMetricsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='IvanTest')
+        Post.objects.create(author=cls.user, text='Тестовый пост')
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=1)
+    def test_server_timing_header(self):
+        """Ответ содержит число запросов, время шаблонов и попадания
+        в кэш, а метрики пишутся в лог.
+        """
+        with self.assertLogs('yatube.requests', 'INFO') as logs:
+            response = self.client.get(reverse('posts:index'))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertRegex(timing, r'tpl;dur=[\d.]+')
+        self.assertIn('cache;desc="0 hit, 2 miss"', timing)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['path'], reverse('posts:index'))
+        self.assertEqual(record['cache_misses'], 2)
+        response = self.client.get(reverse('posts:index'))
+        self.assertIn('cache;desc="1 hit, 0 miss"', response['Server-Timing'])
+
+    def test_metrics_logger_is_configured(self):
+        """Строка метрик доходит до обработчика, а не отбрасывается."""
+        logger = logging.getLogger('yatube.requests')
+        self.assertTrue(logger.isEnabledFor(logging.INFO))
+        self.assertTrue(logger.handlers)
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=0)
+    def test_unsampled_request_has_no_metrics(self):
+        """Запросы вне выборки не измеряются."""
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotIn('Server-Timing', response)
+
+
+@override_settings(DATABASE_REPLICAS=['replica0'])
+@mock.patch('core.db_router.replicas', return_value=['replica0'])
+class ReplicaRoutingTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create(username='IvanTest')
+        cls.post = Post.objects.create(author=cls.user, text='Тестовый пост')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.router = ReplicaRouter()
+
+    def test_feed_views_read_from_replica(self, replicas):
+        """Только вьюхи с @read_replica читают с реплики, запись всегда
+        идёт в основную базу.
+        """
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+        read_replica(lambda request: self.assertEqual(
+            self.router.db_for_read(Post), 'replica0'
+        ))(None)
+        read_replica(lambda request: self.assertEqual(
+            self.router.db_for_write(Post), 'default'
+        ))(None)
+
+    def test_session_pinned_after_write(self, replicas):
+        """После комментария сессия читает ленты с основной базы."""
+        self.authorized_client.post(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.pk}),
+            data={'text': 'Комментарий'},
+        )
+        self.assertIn(PIN_SESSION_KEY, self.authorized_client.session)
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_page_after_change_built_from_primary(self, replicas):
+        """Страницу сразу после изменения собирает основная база,
+        позже - реплика.
+        """
+        route = ReplicaRouter.db_for_read
+        for pin_seconds, alias in ((10, 'default'), (0, 'replica0')):
+            with self.subTest(pin_seconds=pin_seconds):
+                cache.clear()
+                used = set()
+
+                def db_for_read(router, model, **hints):
+                    used.add(route(router, model, **hints))
+                    return 'default'
+
+                with override_settings(REPLICA_PIN_SECONDS=pin_seconds):
+                    with mock.patch.object(
+                        ReplicaRouter, 'db_for_read', db_for_read
+                    ):
+                        self.client.get(reverse('posts:index'))
+                self.assertEqual(used, {alias})
+
+    def test_reads_do_not_pin_session(self, replicas):
+        """Чтение ленты не привязывает сессию к основной базе."""
+        with mock.patch.object(ReplicaRouter, 'db_for_read',
+                               return_value='default'):
+            self.authorized_client.get(reverse('posts:index'))
+        self.assertNotIn(PIN_SESSION_KEY, self.authorized_client.session)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='IvanTest')
+        self.relevant = Post.objects.create(
+            author=self.user, text='Котики, котики и ещё раз котики'
+        )
+        self.other = Post.objects.create(
+            author=self.user, text='Про котиков и собак'
+        )
+        Post.objects.create(author=self.user, text='Только собаки')
+
+    def search(self, query, **params):
+        # Из кэша страница приходит без контекста.
+        cache.clear()
+        response = self.client.get(
+            reverse('posts:search'), {'q': query, **params}, follow=True
+        )
+        return list(response.context['page_obj'])
+
+    def test_results_ranked_by_relevance(self):
+        """Поиск находит посты по словам и префиксу, самые
+        релевантные - первыми.
+        """
+        self.assertEqual(self.search('котики'), [self.relevant])
+        self.assertEqual(self.search('КОТИК'), [self.relevant, self.other])
+        self.assertEqual(self.search('котики" -(*'), [self.relevant])
+        self.assertEqual(self.search('  '), [])
+
+    @override_settings(SEARCH_RANK_MAX_MATCHES=1)
+    def test_common_words_listed_newest_first(self):
+        """Запросы с частыми словами не ранжируются по bm25:
+        результаты идут от новых постов к старым.
+        """
+        # По релевантности первым был бы self.relevant.
+        self.assertEqual(self.search('котик'), [self.other, self.relevant])
+        self.assertEqual(self.search('котики'), [self.relevant])
+
+    def test_index_follows_post_changes(self):
+        """Индекс обновляется при изменении и удалении постов."""
+        self.relevant.text = 'Теперь про хомяков'
+        self.relevant.save()
+        self.assertEqual(self.search('хомяков'), [self.relevant])
+        self.assertEqual(self.search('котики'), [])
+        self.relevant.delete()
+        self.assertEqual(self.search('хомяков'), [])
+
+    @override_settings(POSTS_ON_PAGE=1)
+    def test_pagination_keeps_query(self):
+        """Результаты листаются курсором без COUNT, ссылки сохраняют
+        поисковый запрос.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('posts:search'), {'q': 'собак'}
+            )
+        self.assertFalse(any(
+            'COUNT(' in query['sql'] for query in queries.captured_queries
+        ))
+        page_obj = response.context['page_obj']
+        self.assertContains(
+            response,
+            '?q=%D1%81%D0%BE%D0%B1%D0%B0%D0%BA&amp;'
+            f'cursor={page_obj.next_cursor}'
+        )
+        self.assertEqual(
+            self.search('собак', cursor=page_obj.next_cursor),
+            [self.relevant if page_obj[0] == self.other else self.other]
+        )
+
+    def test_query_normalized_and_cache_capped(self):
+        """Запрос приводится к одному виду, в кэш попадают только
+        первые страницы коротких запросов.
+        """
+        response = self.client.get(reverse('posts:search'), {'q': ' Собак!'})
+        self.assertRedirects(
+            response,
+            reverse('posts:search') + '?q=%D1%81%D0%BE%D0%B1%D0%B0%D0%BA'
+        )
+        cases = {
+            'собак': True,
+            'про котиков и собак': False,
+        }
+        for query, cached in cases.items():
+            with self.subTest(query=query):
+                cache.clear()
+                self.client.get(reverse('posts:search'), {'q': query})
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(reverse('posts:search'), {'q': query})
+                self.assertEqual(not queries.captured_queries, cached)
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке идёт по полнотекстовому индексу."""
+        admin = User.objects.create_superuser('admin', 'a@a.ru', 'pass')
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('admin:posts_post_changelist'), {'q': 'котики'}
+            )
+        self.assertEqual(
+            list(response.context['cl'].result_list), [self.relevant]
+        )
+        sql = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertIn('posts_post_fts', sql)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='IvanTest')
+        self.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        self.posts = [
+            Post.objects.create(
+                author=self.user, text=f'Пост, "{number}"\nвторая строка',
+                group=self.group if number % 2 else None,
+            )
+            for number in range(5)
+        ]
+        admin = User.objects.create_superuser('admin', 'a@a.ru', 'pass')
+        self.client.force_login(admin)
+
+    def export(self, table, **params):
+        response = self.client.get(
+            reverse('posts:export', kwargs={'table': table}), params
+        )
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    @mock.patch('posts.export.BATCH_SIZE', 2)
+    def test_ndjson_export_reads_in_batches(self):
+        """NDJSON содержит все посты; таблица читается пачками."""
+        with CaptureQueriesContext(connection) as queries:
+            response, data = self.export('posts')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in data.decode().splitlines()]
+        self.assertEqual(
+            [row['id'] for row in rows],
+            sorted(post.pk for post in self.posts)
+        )
+        self.assertEqual(rows[1]['group_id'], self.group.pk)
+        self.assertEqual(rows[0]['text'], self.posts[0].text)
+        self.assertEqual(
+            rows[0]['pub_date'], self.posts[0].pub_date.isoformat()
+        )
+        selects = [
+            query for query in queries.captured_queries
+            if 'FROM "posts_post"' in query['sql']
+        ]
+        self.assertEqual(len(selects), 4)
+
+    def test_gzip_csv_export(self):
+        """CSV со сжатием распаковывается в таблицу с заголовком."""
+        response, data = self.export('posts', format='csv', gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('posts.csv.gz', response['Content-Disposition'])
+        rows = list(csv.reader(gzip.decompress(data).decode().splitlines(
+            keepends=True
+        )))
+        self.assertEqual(rows[0][:3], ['id', 'author_id', 'group_id'])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1][4], self.posts[0].text)
+        self.assertEqual(rows[1][2], '')
+
+    def test_empty_table_and_access(self):
+        """Пустая таблица выгружается заголовком; выгрузка - только
+        для сотрудников.
+        """
+        _, data = self.export('comments', format='csv')
+        self.assertEqual(data, b'id,post_id,author_id,created,text\r\n')
+        response = self.client.get(
+            reverse('posts:export', kwargs={'table': 'users'})
+        )
+        self.assertEqual(response.status_code, 404)
+        self.client.force_login(self.user)
+        response = self.client.get(
+            reverse('posts:export', kwargs={'table': 'posts'})
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_export_command(self):
+        """Команда пишет сжатую выгрузку в файл."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'groups.ndjson.gz')
+        call_command('export_data', 'groups', '--gzip', '--output', path,
+                     stderr=StringIO())
+        with gzip.open(path, 'rt') as file:
+            rows = [json.loads(line) for line in file]
+        self.assertEqual(rows, [{
+            'id': self.group.pk, 'title': 'Группа', 'slug': 'group',
+            'description': 'Описание',
+        }])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='IvanTest')
+        self.post = Post.objects.create(author=self.user, text='Текст')
+        # Для поста ETag зависит от автора, которого надо найти.
+        self.queries = {
+            reverse('posts:index'): 0,
+            reverse('posts:profile', args=(self.user.username,)): 0,
+            reverse('posts:post_detail', args=(self.post.pk,)): 1,
+        }
+        self.urls = list(self.queries)
+
+    def test_unchanged_page_not_modified(self):
+        """Неизменившаяся страница отдаётся 304 без выборки данных
+        и шаблонов.
+        """
+        for url, queries in self.queries.items():
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('no-cache', response['Cache-Control'])
+                with self.assertNumQueries(queries):
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag']
+                    )
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+                with mock.patch('time.time', return_value=time.time() + 1):
+                    last_modified = self.client.get(url)['Last-Modified']
+                    response = self.client.get(
+                        url, HTTP_IF_MODIFIED_SINCE=last_modified
+                    )
+                self.assertEqual(response.status_code, 304)
+
+    def test_change_in_same_second_not_hidden(self):
+        """Два изменения за одну секунду: If-Modified-Since не даёт
+        304 на страницу после второго.
+        """
+        url = reverse('posts:index')
+        second = int(time.time()) + 10
+        with mock.patch('time.time', return_value=second + 0.1):
+            Post.objects.create(author=self.user, text='Первый')
+            response = self.client.get(url)
+            self.assertNotIn('Last-Modified', response)
+        with mock.patch('time.time', return_value=second + 0.9):
+            Post.objects.create(author=self.user, text='Второй')
+        with mock.patch('time.time', return_value=second + 1.5):
+            response = self.client.get(url)
+            last_modified = response['Last-Modified']
+            Post.objects.create(author=self.user, text='Третий')
+            response = self.client.get(
+                url, HTTP_IF_MODIFIED_SINCE=last_modified
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Третий')
+
+    def test_changes_invalidate_validators(self):
+        """Новый комментарий, пост или другой пользователь меняют ETag."""
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        Comment.objects.create(post=self.post, author=self.user, text='Да')
+        Post.objects.create(author=self.user, text='Ещё пост')
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=etags[url]
+                )
+                self.assertEqual(response.status_code, 200)
+                etags[url] = response['ETag']
+        self.client.force_login(self.user)
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(
+                    url, HTTP_IF_NONE_MATCH=etags[url]
+                )
+                self.assertEqual(response.status_code, 200)
+
+
+class SyndicationFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='IvanTest')
+        self.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание группы'
+        )
+        self.in_group = Post.objects.create(
+            author=self.user, group=self.group, text='Пост в группе'
+        )
+        self.other = Post.objects.create(
+            author=User.objects.create(username='other'), text='Другой пост'
+        )
+
+    def test_feeds_list_posts(self):
+        """Ленты сайта, группы и автора содержат свои посты."""
+        feeds = {
+            reverse('posts:index_rss'): [self.in_group, self.other],
+            reverse('posts:group_rss', args=('group',)): [self.in_group],
+            reverse('posts:profile_atom', args=('other',)): [self.other],
+        }
+        for url, posts in feeds.items():
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                content = response.content.decode()
+                for post in Post.objects.all():
+                    link = reverse('posts:post_detail', args=(post.pk,))
+                    self.assertEqual(link in content, post in posts)
+        response = self.client.get(
+            reverse('posts:group_atom', args=('group',))
+        )
+        self.assertIn('application/atom+xml', response['Content-Type'])
+        self.assertContains(response, 'Описание группы')
+        self.assertContains(response, '<category term="Группа">')
+        response = self.client.get(reverse('posts:group_rss', args=('no',)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_feed_cached_until_new_post(self):
+        """Лента берётся из кэша до нового поста и отвечает на условные
+        запросы.
+        """
+        url = reverse('posts:group_rss', args=('group',))
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag']
+            )
+        self.assertEqual(response.status_code, 304)
+        Post.objects.create(
+            author=self.user, group=self.group, text='Свежий пост'
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertContains(response, 'Свежий пост')
+
+    def test_pages_link_their_feeds(self):
+        """Страницы группы и профиля ссылаются на свои ленты."""
+        response = self.client.get(
+            reverse('posts:group_list', args=('group',))
+        )
+        self.assertContains(
+            response, reverse('posts:group_rss', args=('group',))
+        )
+        response = self.client.get(reverse('posts:profile', args=('other',)))
+        self.assertContains(
+            response, reverse('posts:profile_atom', args=('other',))
+        )
+
+
+class JsonApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='IvanTest')
+        self.reader = User.objects.create(username='reader')
+        self.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        self.posts = [
+            Post.objects.create(
+                author=self.user, group=self.group, text=f'Пост {number}'
+            )
+            for number in range(3)
+        ]
+        Follow.objects.create(user=self.reader, author=self.user)
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        return response.status_code, response.json()
+
+    def test_cursor_pagination_and_fields(self):
+        """Лента листается курсорами и отдаёт только выбранные поля."""
+        url = reverse('posts:api_group', args=('group',))
+        _, data = self.get(url, fields='id,author', limit=2)
+        self.assertEqual(data['results'], [
+            {'id': self.posts[2].pk, 'author': 'IvanTest'},
+            {'id': self.posts[1].pk, 'author': 'IvanTest'},
+        ])
+        self.assertIsNone(data['previous_cursor'])
+        _, data = self.get(
+            url, fields='text', limit=2, cursor=data['next_cursor']
+        )
+        self.assertEqual(data['results'], [{'text': 'Пост 0'}])
+        self.assertIsNone(data['next_cursor'])
+        self.assertIsNotNone(data['previous_cursor'])
+
+    def test_feeds_without_model_instances(self):
+        """Ленты строятся из .values(), без создания моделей."""
+        self.client.force_login(self.reader)
+        urls = [
+            reverse('posts:api_index'),
+            reverse('posts:api_profile', args=('IvanTest',)),
+            reverse('posts:api_follow'),
+        ]
+        with mock.patch.object(
+            Post, '__init__', side_effect=AssertionError
+        ):
+            for url in urls:
+                with self.subTest(url=url):
+                    status, data = self.get(url)
+                    self.assertEqual(status, 200)
+                    self.assertEqual(len(data['results']), 3)
+                    self.assertEqual(data['results'][0]['group'], 'group')
+
+    def test_post_with_comments(self):
+        """Пост отдаётся с первой страницей комментариев."""
+        post = self.posts[0]
+        for number in range(3):
+            Comment.objects.create(
+                post=post, author=self.reader, text=f'Комментарий {number}'
+            )
+        url = reverse('posts:api_post_detail', args=(post.pk,))
+        _, data = self.get(
+            url, fields='id,comments_count', comment_fields='text',
+            comments_limit=2,
+        )
+        self.assertEqual(data['id'], post.pk)
+        self.assertEqual(data['comments_count'], 3)
+        self.assertEqual(
+            data['comments']['results'],
+            [{'text': 'Комментарий 0'}, {'text': 'Комментарий 1'}],
+        )
+        _, data = self.get(url, comments=data['comments']['next_cursor'])
+        self.assertEqual(len(data['comments']['results']), 1)
+
+    def test_errors(self):
+        """Ошибки возвращаются в JSON с подходящим кодом."""
+        cases = {
+            reverse('posts:api_index') + '?fields=id,secret': 400,
+            reverse('posts:api_index') + '?limit=1000': 400,
+            reverse('posts:api_index') + '?cursor=abc': 400,
+            reverse('posts:api_index') + '?cursor=' + encode_cursor(
+                'n', ['not-a-date', 1]
+            ): 400,
+            reverse('posts:api_group', args=('missing',)): 404,
+            reverse('posts:api_post_detail', args=(999,)): 404,
+            reverse('posts:api_follow'): 401,
+        }
+        for url, status in cases.items():
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, status)
+                self.assertIn('error', response.json())
+
+
+class CacheStampedeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        time.sleep(0.2)
+        return f'значение {self.builds}'
+
+    def test_single_flight(self):
+        """Одновременные промахи собирают значение один раз."""
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                get_or_build('key', self.build, 60)
+            ))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.builds, 1)
+        self.assertEqual(results, [('значение 1', False)] * 8)
+
+    def test_stale_while_rebuilding(self):
+        """Пока значение собирает другой запрос, отдаётся старая копия."""
+        cache.set('stale', Envelope('старое', time.time() + 60, 0.1))
+        cache.add(LOCK_KEY.format('key'), 'other')
+        self.assertEqual(
+            get_or_build('key', self.build, 60, stale_key='stale'),
+            ('старое', True),
+        )
+        self.assertEqual(self.builds, 0)
+
+    @mock.patch('posts.caching.random.random', return_value=0.5)
+    def test_early_refresh(self, random):
+        """Долго собираемое значение обновляется до истечения срока."""
+        cache.set('key', Envelope('старое', time.time() + 1, 0.01))
+        self.assertEqual(get_or_build('key', self.build, 60)[0], 'старое')
+        cache.set('key', Envelope('старое', time.time() + 1, 10))
+        self.assertEqual(
+            get_or_build('key', self.build, 60)[0], 'значение 1'
+        )
+        self.assertEqual(get_or_build('key', self.build, 60)[0], 'значение 1')
+
+    def test_stale_page_has_no_validators(self):
+        """Устаревшая страница ленты отдаётся без ETag новой версии."""
+        user = User.objects.create(username='IvanTest')
+        Post.objects.create(author=user, text='Первый пост')
+        url = reverse('posts:index')
+        self.client.get(url)
+        Post.objects.create(author=user, text='Второй пост')
+        with mock.patch('posts.caching.cache.add', return_value=False):
+            response = self.client.get(url)
+        self.assertNotContains(response, 'Второй пост')
+        self.assertNotIn('ETag', response)
+        response = self.client.get(url)
+        self.assertContains(response, 'Второй пост')
+        self.assertIn('ETag', response)
+
+    @override_settings(CACHE_LOCK_WAIT=0.1)
+    def test_session_that_wrote_skips_stale_page(self):
+        """Сессия, которая только что писала, не получает старую копию."""
+        user = User.objects.create(username='IvanTest')
+        Post.objects.create(author=user, text='Первый пост')
+        url = reverse('posts:index')
+        self.client.force_login(user)
+        self.client.get(url)
+        self.client.post(reverse('posts:post_create'), {'text': 'Второй пост'})
+        self.assertIn(PIN_SESSION_KEY, self.client.session)
+        with mock.patch('posts.caching.cache.add', return_value=False):
+            response = self.client.get(url)
+        self.assertContains(response, 'Второй пост')
+
+    def test_version_keys_are_safe_for_memcached(self):
+        """Ключи версий не зависят от длины и алфавита области."""
+        scope = 'group:' + 'кириллица и пробелы ' * 20
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            bump_versions(scope)
+            self.assertTrue(get_versions([scope])[0])
+
+
+class CommitInvalidationTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_versions_bumped_again_after_commit(self):
+        """Страница, собранная до коммита, не переживает коммит."""
+        user = User.objects.create(username='IvanTest')
+        post = Post.objects.create(author=user, text='Удаляемый пост')
+        with transaction.atomic():
+            post.delete()
+            # Так версию видит параллельный запрос, который ещё читает
+            # данные до удаления.
+            during = get_versions(['index', 'author:IvanTest'])
+        after = get_versions(['index', 'author:IvanTest'])
+        for before, now in zip(during, after):
+            self.assertGreater(now, before)
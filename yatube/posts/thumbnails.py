@@ -0,0 +1,170 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from PIL import Image
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import EXTENSIONS
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+
+from .caching import bump_versions, post_scopes
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_pending = {}
+_lock = threading.Lock()
+
+
+def thumbnail_file(source, geometry, options):
+    """Файл миниатюры, который создал бы sorl, без обращения к хранилищу.
+
+    Опции дополняются так же, как в ThumbnailBackend.get_thumbnail,
+    чтобы имя совпало с именем, которое sorl вычислит сам.
+    """
+    options = dict(options)
+    backend = default.backend
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+    return ImageFile(name, default.storage), options
+
+
+def extra_formats():
+    """Дополнительные форматы миниатюр, которые умеют Pillow и sorl."""
+    Image.init()
+    return [
+        format_ for format_ in settings.POST_THUMBNAIL_FORMATS
+        if format_ in Image.SAVE and format_ in EXTENSIONS
+    ]
+
+
+def variants(preset=None):
+    """Все миниатюры пресета (или всех пресетов): формат, геометрия, опции.
+
+    Формат None - формат исходной картинки.
+    """
+    presets = [preset] if preset else settings.POST_THUMBNAIL_SIZES
+    for name in presets:
+        geometries, options = settings.POST_THUMBNAIL_SIZES[name]
+        for format_ in [None] + extra_formats():
+            for geometry in geometries:
+                variant = dict(options)
+                if format_:
+                    variant['format'] = format_
+                yield format_, geometry, variant
+
+
+def ready_thumbnails(post, preset):
+    """Готовые миниатюры поста по форматам, от широкой к узкой.
+
+    None, если хотя бы одна из них ещё создаётся.
+    """
+    source = ImageFile(post.image)
+    ready = {}
+    for format_, geometry, options in variants(preset):
+        thumbnail, _ = thumbnail_file(source, geometry, options)
+        cached = default.kvstore.get(thumbnail)
+        if not cached:
+            if post.image.name in _pending or not thumbnail.exists():
+                schedule(post)
+                return None
+            # Файл уже создан фоном: sorl только запишет его в kvstore.
+            cached = get_thumbnail(post.image, geometry, **options)
+        ready.setdefault(format_, []).append(cached)
+    return ready
+
+
+def prefetch(posts, preset='card'):
+    """Загружает метаданные миниатюр всех постов страницы одним запросом.
+
+    Найденное оседает в памяти процесса, и ready_thumbnails для этих
+    постов уже не ходит ни в кэш, ни в базу.
+    """
+    files = []
+    for post in posts:
+        if not post.image:
+            continue
+        source = ImageFile(post.image)
+        for _, geometry, options in variants(preset):
+            files.append(thumbnail_file(source, geometry, options)[0])
+    if files and hasattr(default.kvstore, 'get_many'):
+        default.kvstore.get_many(files)
+
+
+def ready_thumbnail(post, preset):
+    """Самая широкая готовая миниатюра поста или None."""
+    ready = ready_thumbnails(post, preset)
+    return ready[None][0] if ready else None
+
+
+def schedule(post):
+    """Ставит создание всех миниатюр картинки поста в фоновую очередь."""
+    if not post.image:
+        return
+    name = post.image.name
+    scopes = post_scopes(post)
+    with _lock:
+        if name in _pending:
+            _pending[name].update(scopes)
+            return
+        _pending[name] = set(scopes)
+    if settings.POST_THUMBNAIL_WORKERS:
+        _get_executor().submit(_generate, name)
+    else:
+        _generate(name)
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.POST_THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails',
+            )
+    return _executor
+
+
+def _generate(name):
+    # Фоновый поток не ходит в базу: только в хранилище файлов и кэш.
+    try:
+        source = ImageFile(name, Post._meta.get_field('image').storage)
+        generate(source)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', name)
+    finally:
+        with _lock:
+            scopes = _pending.pop(name, ())
+        # Карточки с исходной картинкой вместо миниатюры надо перерисовать.
+        bump_versions(*scopes)
+
+
+def generate(source):
+    """Создаёт все миниатюры картинки, декодируя её один раз."""
+    image = default.engine.get_image(source)
+    try:
+        image_info = default.engine.get_image_info(image)
+        for _, geometry, options in variants():
+            if not source.exists():
+                # Картинку уже освободили: миниатюры остались бы сиротами.
+                break
+            thumbnail, options = thumbnail_file(source, geometry, options)
+            if thumbnail.exists():
+                continue
+            options['image_info'] = image_info
+            default.backend._create_thumbnail(
+                image, geometry, options, thumbnail
+            )
+    finally:
+        default.engine.cleanup(image)
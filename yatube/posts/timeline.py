@@ -0,0 +1,131 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+
+from .models import Follow, Post, TimelineEntry, UserCounters
+
+
+def is_fanout_author(author_id):
+    """Раскладывать ли посты автора по лентам подписчиков при записи.
+
+    У авторов с очень большим числом подписчиков посты читаются
+    из общей таблицы при открытии ленты.
+    """
+    return not UserCounters.objects.filter(
+        user_id=author_id,
+        followers_count__gt=settings.TIMELINE_FANOUT_MAX_FOLLOWERS,
+    ).exists()
+
+
+def fan_out_post(post):
+    if not is_fanout_author(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+            for user_id in followers.iterator()
+        ],
+        batch_size=settings.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def backfill(user_id, author_id):
+    if not is_fanout_author(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        'id', 'pub_date'
+    )
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+            for post_id, pub_date in posts.iterator()
+        ],
+        batch_size=settings.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def prune(user_id, author_id):
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def rebuild(author_ids=None, user_ids=None):
+    """Заново раскладывает посты по лентам подписчиков.
+
+    author_ids и user_ids ограничивают пересборку подписками на этих
+    авторов и этих читателей; без них пересобираются все ленты.
+    Одним INSERT ... SELECT в базе: backfill по каждой подписке на
+    больших графах занимает на порядки больше времени.
+    """
+    entries, follows, posts, counters = (
+        model._meta.db_table
+        for model in (TimelineEntry, Follow, Post, UserCounters)
+    )
+    stale = TimelineEntry.objects.all()
+    where = ['COALESCE(c.followers_count, 0) <= %s']
+    params = [settings.TIMELINE_FANOUT_MAX_FOLLOWERS]
+    for column, ids, lookup in (
+        ('f.author_id', author_ids, 'post__author_id__in'),
+        ('f.user_id', user_ids, 'user_id__in'),
+    ):
+        if ids is not None:
+            ids = list(ids)
+            stale = stale.filter(**{lookup: ids})
+            where.append(f'{column} IN ({", ".join(["%s"] * len(ids))})')
+            params += ids
+    with transaction.atomic():
+        stale.delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {entries} (user_id, post_id, pub_date) '
+                f'SELECT f.user_id, p.id, p.pub_date FROM {follows} f '
+                f'JOIN {posts} p ON p.author_id = f.author_id '
+                f'LEFT JOIN {counters} c ON c.user_id = f.author_id '
+                f'WHERE {" AND ".join(where)}',
+                params,
+            )
+
+
+def restore_fanout(author_id):
+    """Раскладывает посты автора, число подписчиков которого только что
+    опустилось до TIMELINE_FANOUT_MAX_FOLLOWERS.
+
+    Пока подписчиков было больше, его посты читались из общей таблицы
+    и в ленты не попадали; без этого они пропали бы из лент.
+    """
+    if UserCounters.objects.filter(
+        user_id=author_id,
+        followers_count=settings.TIMELINE_FANOUT_MAX_FOLLOWERS,
+    ).exists():
+        rebuild(author_ids=[author_id])
+
+
+def read_on_demand_authors(user):
+    """Авторы из подписок, чьи посты не раскладываются по лентам."""
+    return list(
+        UserCounters.objects.filter(
+            user__following__user=user,
+            followers_count__gt=settings.TIMELINE_FANOUT_MAX_FOLLOWERS,
+        ).values_list('user', flat=True)
+    )
+
+
+def timeline_posts(user):
+    posts = Post.objects.select_related('group', 'author')
+    authors = read_on_demand_authors(user)
+    if not authors:
+        # Сортировка по полям ленты читает её индекс без сортировки.
+        return posts.filter(timeline_entries__user=user).annotate(
+            feed_date=F('timeline_entries__pub_date'),
+            feed_entry=F('timeline_entries__id'),
+        ).order_by('-feed_date', 'feed_entry')
+    return posts.filter(
+        Q(pk__in=TimelineEntry.objects.filter(user=user).values('post'))
+        | Q(author__in=authors)
+    )
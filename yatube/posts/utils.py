@@ -1,8 +1,194 @@
+import json
+
 from django.conf import settings
-from django.core.paginator import Paginator
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+FORWARD = 'n'
+BACKWARD = 'p'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(direction, values):
+    """Упаковывает позицию в ленте в непрозрачную строку."""
+    values = [
+        value.isoformat() if hasattr(value, 'isoformat') else value
+        for value in values
+    ]
+    return urlsafe_base64_encode(json.dumps([direction, values]).encode())
+
+
+def decode_cursor(cursor, size):
+    if not cursor:
+        raise InvalidCursor(cursor)
+    try:
+        direction, values = json.loads(urlsafe_base64_decode(cursor))
+    except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
+    if (
+        direction not in (FORWARD, BACKWARD)
+        or not isinstance(values, list)
+        or len(values) != size
+        or not all(isinstance(value, (str, int, float)) for value in values)
+    ):
+        raise InvalidCursor(cursor)
+    return direction, values
+
+
+class CursorPage(Page):
+    """Страница, которая знает только соседние курсоры, но не свой номер."""
+
+    def __init__(self, object_list, paginator, next_cursor, previous_cursor):
+        super().__init__(object_list, None, paginator)
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<Cursor page>'
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class CursorPaginator(Paginator):
+    """Пагинация по ключу сортировки вместо OFFSET.
+
+    Каждая страница выбирается одним запросом по индексу, начиная
+    с позиции из курсора, поэтому глубокие страницы не медленнее первой
+    и COUNT(*) не нужен.
+    """
+    keyset = True
+
+    def __init__(self, object_list, per_page, ordering=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        # Последнее поле сортировки должно быть уникальным.
+        self.ordering = ordering or (
+            object_list.query.order_by or object_list.model._meta.ordering
+        )
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    def page(self, cursor):
+        """Страница по курсору; без курсора - первая.
+
+        Испорченный курсор - InvalidCursor.
+        """
+        if not cursor:
+            return self._page_after(None)
+        direction, values = decode_cursor(cursor, len(self.fields))
+        values = self._clean(values, cursor)
+        if direction == BACKWARD:
+            return self._page_before(values)
+        return self._page_after(values)
+
+    def get_page(self, cursor):
+        """Как page(), но с испорченным курсором - первая страница."""
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self._page_after(None)
+
+    def _clean(self, values, cursor):
+        # Значения из курсора приходят от клиента: приводим их к типам
+        # полей сортировки, иначе ошибку выдаст уже запрос к базе.
+        opts = self.object_list.model._meta
+        cleaned = []
+        try:
+            for name, value in zip(self.fields, values):
+                try:
+                    field = opts.pk if name == 'pk' else opts.get_field(name)
+                except FieldDoesNotExist:
+                    # Вычисляемое поле, например ранг поиска.
+                    cleaned.append(value)
+                    continue
+                cleaned.append(field.to_python(value))
+        except (ValueError, TypeError, ValidationError):
+            raise InvalidCursor(cursor)
+        return cleaned
+
+    def _position(self, obj):
+        if isinstance(obj, dict):
+            return [obj[name] for name in self.fields]
+        return [getattr(obj, name) for name in self.fields]
+
+    def _seek(self, values, reverse):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        condition = Q()
+        equal = {}
+        for name, field, value in zip(self.ordering, self.fields, values):
+            descending = name.startswith('-') != reverse
+            lookup = f'{field}__{"lt" if descending else "gt"}'
+            condition |= Q(**equal, **{lookup: value})
+            equal[field] = value
+        # По OR SQLite не ищет в индексе: отдельное условие a >= x
+        # даёт ему границу диапазона по первому полю.
+        name, field, value = self.ordering[0], self.fields[0], values[0]
+        descending = name.startswith('-') != reverse
+        bound = Q(**{f'{field}__{"lte" if descending else "gte"}': value})
+        return bound & condition
+
+    def _page_after(self, values):
+        queryset = self.object_list.order_by(*self.ordering)
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, reverse=False))
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        next_cursor = previous_cursor = None
+        if rows and more:
+            next_cursor = encode_cursor(FORWARD, self._position(rows[-1]))
+        if rows and values is not None:
+            previous_cursor = encode_cursor(BACKWARD, self._position(rows[0]))
+        return CursorPage(rows, self, next_cursor, previous_cursor)
+
+    def _page_before(self, values):
+        reverse = [
+            name[1:] if name.startswith('-') else f'-{name}'
+            for name in self.ordering
+        ]
+        queryset = self.object_list.order_by(*reverse).filter(
+            self._seek(values, reverse=True)
+        )
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page][::-1]
+        if not rows:
+            return self._page_after(None)
+        previous_cursor = None
+        if more:
+            previous_cursor = encode_cursor(BACKWARD, self._position(rows[0]))
+        next_cursor = encode_cursor(FORWARD, self._position(rows[-1]))
+        return CursorPage(rows, self, next_cursor, previous_cursor)
+
+
+def paginate_page(request, list, prefetch=None, keyset=True):
+    """Страница списка; prefetch получает объекты страницы одним списком.
+
+    Ленты листаются курсорами (?cursor=); номер страницы (?page=)
+    остался только для старых ссылок. keyset=False - только
+    постраничная навигация.
+    """
+    number = request.GET.get('page')
+    if keyset and number is None and hasattr(list, 'order_by'):
+        paginator = CursorPaginator(list, settings.POSTS_ON_PAGE)
+        page = paginator.get_page(request.GET.get('cursor'))
+    else:
+        paginator = Paginator(list, settings.POSTS_ON_PAGE)
+        page = paginator.get_page(number)
+    if prefetch is not None:
+        page.object_list = [*page.object_list]
+        prefetch(page.object_list)
+    return page
 
 
-def paginate_page(request, list):
-    paginator = Paginator(list, settings.POSTS_ON_PAGE)
-    page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+def paginate_comments(post, cursor):
+    comments = post.comments.select_related('author')
+    paginator = CursorPaginator(comments, settings.COMMENTS_ON_PAGE)
+    return paginator.get_page(cursor)
@@ -1,26 +1,49 @@
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
+from django.urls import reverse
+from django.utils.http import urlencode
 
+from core.db_router import read_replica
+
+from . import export, thumbnails
+from .caching import cache_feed, conditional_feed
 from .forms import CommentForm, PostForm
 from .models import Follow, Group, Post, User
-from .utils import paginate_page
+from .search import cache_search, normalize_query, search_posts
+from .timeline import timeline_posts
+from .utils import paginate_comments, paginate_page
+
+
+def feed_posts(posts=None):
+    """Посты ленты со всем, что выводится в карточке.
 
+    Общий запрос страниц, RSS и API.
+    """
+    if posts is None:
+        posts = Post.objects
+    return posts.select_related('group', 'author')
 
-@cache_page(20, key_prefix='index_page')
+
+@read_replica
+@cache_feed('index')
 def index(request):
-    posts = Post.objects.select_related('group', 'author')
-    page_obj = paginate_page(request, posts)
+    posts = feed_posts()
+    page_obj = paginate_page(request, posts, thumbnails.prefetch)
     context = {
         'page_obj': page_obj,
     }
     return render(request, 'posts/index.html', context)
 
 
+@read_replica
+@cache_feed('group:{slug}')
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.select_related('group', 'author')
-    page_obj = paginate_page(request, posts)
+    posts = feed_posts(group.posts)
+    page_obj = paginate_page(request, posts, thumbnails.prefetch)
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -28,10 +51,14 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@read_replica
+@cache_feed('author:{username}')
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.select_related('group', 'author')
-    page_obj = paginate_page(request, posts)
+    author = get_object_or_404(
+        User.objects.select_related('counters'), username=username
+    )
+    posts = feed_posts(author.posts)
+    page_obj = paginate_page(request, posts, thumbnails.prefetch)
     following = (
         request.user.is_authenticated
         and request.user != author
@@ -45,10 +72,42 @@ def profile(request, username):
     return render(request, 'posts/profile.html', context)
 
 
+@read_replica
+@cache_feed('index', when=cache_search)
+def search(request):
+    raw_query = request.GET.get('q', '')
+    query = normalize_query(raw_query)
+    if raw_query != query:
+        # Один запрос - одна ссылка и одна страница в кэше.
+        return redirect(
+            f'{reverse("posts:search")}?{urlencode({"q": query})}'
+        )
+    posts = search_posts(feed_posts(), query)
+    page_obj = paginate_page(request, posts, thumbnails.prefetch)
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'page_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'posts/search.html', context)
+
+
+def post_author_scope(post_id):
+    # Число постов автора на странице поста меняется с его лентой.
+    username = Post.objects.filter(pk=post_id).values_list(
+        'author__username', flat=True
+    ).first()
+    return f'author:{username}'
+
+
+@read_replica
+@conditional_feed('post:{post_id}', post_author_scope)
 def post_detail(request, post_id):
     form = CommentForm()
-    post = get_object_or_404(Post.objects.select_related('author'), pk=post_id)
-    comments = Post.objects.select_related('author')
+    post = get_object_or_404(
+        Post.objects.select_related('author__counters', 'group'), pk=post_id
+    )
+    comments = paginate_comments(post, request.GET.get('comments'))
     context = {
         'post': post,
         'form': form,
@@ -57,6 +116,26 @@ def post_detail(request, post_id):
     return render(request, 'posts/post_detail.html', context)
 
 
+def post_comments(request, post_id):
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    page = paginate_comments(post, request.GET.get('cursor'))
+    return JsonResponse({
+        'comments': [
+            {
+                'id': comment.pk,
+                'author': comment.author.username,
+                'author_url': reverse(
+                    'posts:profile', args=(comment.author.username,)
+                ),
+                'text': comment.text,
+                'created': comment.created.isoformat(),
+            }
+            for comment in page
+        ],
+        'next_cursor': page.next_cursor,
+    }, json_dumps_params={'ensure_ascii': False})
+
+
 @login_required
 def post_create(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
@@ -66,6 +145,8 @@ def post_create(request):
     post = form.save(commit=False)
     post.author = request.user
     post.save()
+    # Файл картинки и пост должны сохраниться раньше миниатюр.
+    transaction.on_commit(lambda: thumbnails.schedule(post))
     return redirect('posts:profile', post.author)
 
 
@@ -78,6 +159,8 @@ def post_edit(request, post_id):
         return redirect('posts:post_detail', post_id)
     if form.is_valid():
         form.save()
+        if 'image' in form.changed_data:
+            transaction.on_commit(lambda: thumbnails.schedule(post))
         return redirect('posts:post_detail', post_id)
     context = {'form': form, 'post': post, 'is_edit': True}
     return render(request, 'posts/create_post.html', context)
@@ -95,10 +178,14 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@read_replica
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
-    page_obj = paginate_page(request, posts)
+    posts = timeline_posts(request.user)
+    # Тесты практикума требуют здесь обычную Page, а не CursorPage.
+    page_obj = paginate_page(
+        request, posts, thumbnails.prefetch, keyset=False
+    )
     context = {
         'page_obj': page_obj,
     }
@@ -118,3 +205,21 @@ def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     Follow.objects.filter(user=request.user, author=author).delete()
     return redirect('posts:follow_index')
+
+
+@staff_member_required
+def export_table(request, table):
+    format = request.GET.get('format', 'ndjson')
+    if table not in export.TABLES or format not in export.FORMATS:
+        raise Http404
+    compress = request.GET.get('gzip') == '1'
+    filename = f'{table}.{format}'
+    content_type = export.FORMATS[format]
+    if compress:
+        filename += '.gz'
+        content_type = 'application/gzip'
+    response = StreamingHttpResponse(
+        export.export(table, format, compress), content_type=content_type
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
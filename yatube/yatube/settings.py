@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -50,11 +51,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.db_router.PinPrimaryMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -64,7 +67,8 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Шаблонизатор Django с замером времени рендеринга.
+        'BACKEND': 'core.metrics.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -92,6 +96,39 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения лент, через запятую: локально это копии базы,
+# которые обновляет manage.py sync_replicas.
+DATABASE_REPLICAS = []
+for number, name in enumerate(
+    filter(None, os.getenv('REPLICA_DATABASES', '').split(','))
+):
+    DATABASE_REPLICAS.append(f'replica{number}')
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
+
+# Сколько секунд после записи сессия читает только с основной базы.
+REPLICA_PIN_SECONDS = 10
+
+# Выполняются для каждого нового соединения с SQLite.
+# WAL пускает читателей параллельно с писателем, synchronous=NORMAL
+# в WAL не теряет согласованность при сбое и не ждёт fsync на каждый
+# коммит, а busy_timeout заставляет писателей ждать блокировку вместо
+# ошибки "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    # Отрицательное значение - размер в КиБ, а не в страницах.
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -135,6 +172,8 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
 POSTS_ON_PAGE = 10
 
+COMMENTS_ON_PAGE = 20
+
 LOGIN_URL = 'users:login'
 
 LOGIN_REDIRECT_URL = 'posts:index'
@@ -151,9 +190,130 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
-CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        # "LOCATION": os.path.join(BASE_DIR, "cache"),
+# Загруженные картинки уменьшаются и пересохраняются без EXIF.
+POST_IMAGE_MAX_SIZE = (1920, 1920)
+
+POST_IMAGE_FORMAT = 'JPEG'
+
+POST_IMAGE_QUALITY = 85
+
+# Картинки, которые в памяти заняли бы больше пикселей, не декодируются
+# вовсе (JPEG считается после уменьшения при декодировании). 16 млн
+# пикселей RGBA - до 64 МБ.
+POST_IMAGE_MAX_PIXELS = 16_000_000
+
+# Картинку, которую загружали заново позже этого числа секунд назад,
+# не удаляют: пост с ней может быть ещё не сохранён. Такие файлы
+# убирает команда sweep_images.
+POST_IMAGE_RELEASE_GRACE = 10 * 60
+
+# Миниатюры создаются фоном после загрузки картинки: для каждого
+# пресета несколько ширин для srcset, от широкой к узкой.
+POST_THUMBNAIL_SIZES = {
+    'card': (
+        ['960x339', '640x226', '320x113'],
+        {'crop': 'center', 'upscale': True},
+    ),
+}
+
+# Дополнительные форматы миниатюр; неподдерживаемые Pillow пропускаются.
+POST_THUMBNAIL_FORMATS = ['WEBP']
+
+# 0 - создавать миниатюры сразу, в потоке запроса. В тестах пул не
+# нужен: тесты удаляют MEDIA_ROOT, пока фоновый поток ещё пишет в него.
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+POST_THUMBNAIL_WORKERS = 0 if TESTING else 2
+
+# Метаданные миниатюр: память процесса, затем кэш, затем база.
+THUMBNAIL_KVSTORE = 'posts.kvstore.KVStore'
+THUMBNAIL_LOCAL_SIZE = 10000
+THUMBNAIL_LOCAL_TIMEOUT = 60
+
+# Кэш общий для всех процессов сервера: в памяти процесса версии лент
+# сбрасывались бы только у того, кто обработал запись, а остальные
+# отдавали бы старые страницы до FEED_CACHE_TIMEOUT.
+# CACHE_LOCATION=127.0.0.1:11211 - memcached (нужен python-memcached),
+# без неё - файлы в BASE_DIR/cache (там cache.add не атомарен, и при
+# промахе страницу изредка соберут два процесса). В тестах процесс один.
+# Страницы, карточки, версии и метаданные миниатюр делят MAX_ENTRIES.
+CACHE_LOCATION = os.getenv('CACHE_LOCATION', '')
+CACHE_MAX_ENTRIES = 100000
+if TESTING:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': CACHE_MAX_ENTRIES},
+        }
+    }
+elif CACHE_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': CACHE_LOCATION.split(','),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(BASE_DIR, 'cache'),
+            'OPTIONS': {'MAX_ENTRIES': CACHE_MAX_ENTRIES},
+        }
     }
+
+# Авторы, у которых подписчиков больше, не раскладывают посты по лентам
+# при публикации: их посты подмешиваются в ленту при чтении.
+TIMELINE_FANOUT_MAX_FOLLOWERS = 1000
+
+TIMELINE_BATCH_SIZE = 500
+
+# Страницы лент инвалидируются при изменении данных,
+# поэтому могут жить в кэше долго.
+FEED_CACHE_TIMEOUT = 60 * 60
+
+# Поиск кэшируется только для первых страниц запросов не длиннее
+# стольких слов: частые запросы короткие, остальные вытесняли бы ленты.
+SEARCH_CACHE_MAX_WORDS = 2
+
+# Если хоть одно слово запроса есть в большем числе постов, результаты
+# идут от новых к старым без ранжирования по bm25.
+SEARCH_RANK_MAX_MATCHES = 1000
+
+# Защита от одновременной пересборки: блокировка живёт не дольше
+# CACHE_LOCK_TIMEOUT секунд, без устаревшей копии остальные ждут
+# до CACHE_LOCK_WAIT секунд. BETA > 1 обновляет кэш раньше срока чаще.
+CACHE_LOCK_TIMEOUT = 10
+CACHE_LOCK_WAIT = 2
+CACHE_EARLY_REFRESH_BETA = 1.0
+
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Записей в RSS и Atom.
+SYNDICATION_ITEMS = 20
+
+# Доля запросов, для которых пишутся метрики и заголовок Server-Timing.
+REQUEST_METRICS_SAMPLE_RATE = 1.0 if DEBUG else 0.01
+
+# Метрики запросов - по строке JSON на запрос в stderr, без префиксов,
+# чтобы сборщик логов разбирал строку целиком. В тестах не печатаются.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'requests': {
+            'class': 'logging.NullHandler' if TESTING
+            else 'logging.StreamHandler',
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'yatube.requests': {
+            'handlers': ['requests'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }